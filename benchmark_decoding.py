@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import platform
+import sys
+import timeit
+
+import numpy as np
+
+import decoding
+
+# The per-span loops the model used before are kept as the reference implementation of the tests.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "test"))
+import decoding_test
+
+# Usage: python benchmark_decoding.py [num_top_spans ...]
+# Times antecedent decoding and clustering of random predictions with the per-span loops the model used before and
+# with decoding.py, and checks that they produce the same clusters. Times are the best of 5 repeats of 10 calls, so the
+# speedup depends on the machine (printed first) but not much on its load.
+
+def legacy_decode(top_span_starts, top_span_ends, antecedents, antecedent_scores):
+  predicted_antecedents = decoding_test.legacy_get_predicted_antecedents(antecedents, antecedent_scores)
+  return decoding_test.legacy_get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
+
+def decode(top_span_starts, top_span_ends, antecedents, antecedent_scores):
+  predicted_antecedents = decoding.get_predicted_antecedents(antecedents, antecedent_scores)
+  return decoding.get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
+
+def milliseconds_per_call(f, inputs, num_runs=10, num_repeats=5):
+  return 1000 * min(timeit.repeat(lambda: f(*inputs), number=num_runs, repeat=num_repeats)) / num_runs
+
+if __name__ == "__main__":
+  top_span_counts = [int(k) for k in sys.argv[1:]] or [400, 1000, 4000]
+  max_top_antecedents = 50
+  random_state = np.random.RandomState(0)
+
+  print("{}, Python {}, NumPy {}".format(platform.processor() or platform.machine(), platform.python_version(), np.__version__))
+  print("{:>10} {:>12} {:>12} {:>10} {:>8}".format("top spans", "legacy (ms)", "numpy (ms)", "speedup", "same"))
+  for k in top_span_counts:
+    # Distinct spans, as selected by the model.
+    top_span_starts = np.sort(random_state.choice(int(k / 0.4), k, replace=False)).astype(np.int32)
+    top_span_ends = top_span_starts + random_state.randint(0, 10, size=k).astype(np.int32)
+    antecedent_offsets = np.arange(1, max_top_antecedents + 1)[None, :]
+    antecedents = np.maximum(np.arange(k)[:, None] - antecedent_offsets, 0).astype(np.int32)
+    # A dummy score of 0, so that about half of the spans get an antecedent.
+    antecedent_scores = np.concatenate([np.zeros([k, 1]), random_state.randn(k, max_top_antecedents) - 2], 1).astype(np.float32)
+    antecedent_scores[:, 1:][np.arange(k)[:, None] - antecedent_offsets < 0] = -np.inf # Masked as in the model.
+    inputs = [top_span_starts, top_span_ends, antecedents, antecedent_scores]
+
+    legacy_ms = milliseconds_per_call(legacy_decode, inputs)
+    numpy_ms = milliseconds_per_call(decode, inputs)
+    print("{:>10} {:>12.2f} {:>12.2f} {:>9.1f}x {:>8}".format(k, legacy_ms, numpy_ms, legacy_ms / numpy_ms,
+                                                            "yes" if legacy_decode(*inputs) == decode(*inputs) else "NO"))
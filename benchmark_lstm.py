@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+import util
+
+# Usage: python benchmark_lstm.py [num_sentences] [max_sentence_length]
+# Reports tokens/sec of one bidirectional contextualization layer with the step-by-step and the fused kernels, for the
+# input sizes of the first layer (GloVe + char CNN + ELMo) and of the following layers.
+
+def build_layer(inputs, text_len, contextualization_size, fused):
+  num_sentences = tf.shape(inputs)[0]
+  with tf.variable_scope("fw_cell"):
+    cell_fw = util.CustomLSTMCell(contextualization_size, num_sentences, 1.0)
+  with tf.variable_scope("bw_cell"):
+    cell_bw = util.CustomLSTMCell(contextualization_size, num_sentences, 1.0)
+  if fused:
+    fw_outputs, bw_outputs = util.fused_bidirectional_rnn(cell_fw, cell_bw, inputs, text_len)
+  else:
+    state_fw = tf.contrib.rnn.LSTMStateTuple(tf.tile(cell_fw.initial_state.c, [num_sentences, 1]), tf.tile(cell_fw.initial_state.h, [num_sentences, 1]))
+    state_bw = tf.contrib.rnn.LSTMStateTuple(tf.tile(cell_bw.initial_state.c, [num_sentences, 1]), tf.tile(cell_bw.initial_state.h, [num_sentences, 1]))
+    (fw_outputs, bw_outputs), _ = tf.nn.bidirectional_dynamic_rnn(cell_fw, cell_bw, inputs, sequence_length=text_len,
+                                                                  initial_state_fw=state_fw, initial_state_bw=state_bw)
+  return tf.concat([fw_outputs, bw_outputs], 2)
+
+def tokens_per_second(session, outputs, feed_dict, num_tokens, num_runs=10):
+  session.run(outputs, feed_dict=feed_dict) # Warm up.
+  start_time = time.time()
+  for _ in range(num_runs):
+    session.run(outputs, feed_dict=feed_dict)
+  return num_runs * num_tokens / (time.time() - start_time)
+
+if __name__ == "__main__":
+  num_sentences = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+  max_sentence_length = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+  contextualization_size = 200
+  text_len = np.random.randint(1, max_sentence_length + 1, size=num_sentences)
+  text_len[0] = max_sentence_length
+
+  for layer, input_size in (("first", 300 + 150 + 1024), ("other", 2 * contextualization_size)):
+    tf.reset_default_graph()
+    inputs_ph = tf.placeholder(tf.float32, [None, None, input_size])
+    text_len_ph = tf.placeholder(tf.int32, [None])
+    with tf.variable_scope("custom"):
+      custom_outputs = build_layer(inputs_ph, text_len_ph, contextualization_size, fused=False)
+    with tf.variable_scope("custom", reuse=True):
+      fused_outputs = build_layer(inputs_ph, text_len_ph, contextualization_size, fused=True)
+
+    feed_dict = { inputs_ph: np.random.randn(num_sentences, max_sentence_length, input_size), text_len_ph: text_len }
+    with tf.Session() as session:
+      session.run(tf.global_variables_initializer())
+      mask = np.arange(max_sentence_length)[None, :] < text_len[:, None]
+      custom_values, fused_values = session.run([custom_outputs, fused_outputs], feed_dict=feed_dict)
+      max_difference = np.abs(custom_values - fused_values)[mask].max()
+      custom_speed = tokens_per_second(session, custom_outputs, feed_dict, text_len.sum())
+      fused_speed = tokens_per_second(session, fused_outputs, feed_dict, text_len.sum())
+    print("{} layer (input size {}): custom {:.0f} tokens/s, fused {:.0f} tokens/s ({:.2f}x), max output difference {:.2e}".format(
+      layer, input_size, custom_speed, fused_speed, fused_speed / custom_speed, max_difference))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import metrics
+
+# ceafe with a single dense alignment is kept as the reference implementation of the tests.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "test"))
+import metrics_test
+
+# Usage: python benchmark_metrics.py [num_mentions ...]
+# Times ceafe on random documents with a single dense alignment and with the overlap graph split into connected
+# components, and checks that they agree. muc and b_cubed are timed for reference.
+
+def realistic_document(random_state, num_mentions, mean_cluster_size=3, error_rate=0.1):
+  # Predictions agree with the gold clusters except for a fraction of missed or reassigned mentions, as for a model.
+  spans = [(2 * i, 2 * i + 1) for i in range(num_mentions)]
+  num_clusters = max(1, num_mentions // mean_cluster_size)
+  gold_assignments = random_state.randint(0, num_clusters, size=num_mentions)
+  errors = random_state.rand(num_mentions) < error_rate
+  predicted_assignments = np.where(errors, random_state.randint(-num_clusters // 2, num_clusters, size=num_mentions), gold_assignments)
+  def _clusters(assignments):
+    clusters = {}
+    for m, a in zip(spans, assignments):
+      if a >= 0:
+        clusters.setdefault(a, []).append(m)
+    return [tuple(c) for c in clusters.values()]
+  return _clusters(predicted_assignments), _clusters(gold_assignments)
+
+def mention_to_cluster(clusters):
+  return {m:c for c in clusters for m in c}
+
+def muc_b_cubed_counts(predicted, gold):
+  mention_to_predicted, mention_to_gold = mention_to_cluster(predicted), mention_to_cluster(gold)
+  return [metric(predicted, mention_to_gold) + metric(gold, mention_to_predicted) for metric in (metrics.muc, metrics.b_cubed)]
+
+def milliseconds_per_call(f, inputs, num_runs=5):
+  start_time = time.time()
+  for _ in range(num_runs):
+    f(*inputs)
+  return 1000 * (time.time() - start_time) / num_runs
+
+if __name__ == "__main__":
+  document_sizes = [int(n) for n in sys.argv[1:]] or [100, 500, 2000]
+  random_state = np.random.RandomState(0)
+
+  print("{:>10} {:>10} {:>16} {:>12} {:>12} {:>10} {:>8}".format(
+    "mentions", "clusters", "muc+b_cubed (ms)", "dense ceafe", "ceafe (ms)", "speedup", "same"))
+  for num_mentions in document_sizes:
+    predicted, gold = realistic_document(random_state, num_mentions)
+    muc_b_cubed_ms = milliseconds_per_call(muc_b_cubed_counts, [predicted, gold])
+    dense_ceafe_ms = milliseconds_per_call(metrics_test.dense_ceafe, [predicted, gold])
+    ceafe_ms = milliseconds_per_call(metrics.ceafe, [predicted, gold])
+    same = np.allclose(metrics_test.dense_ceafe(predicted, gold), metrics.ceafe(predicted, gold))
+    print("{:>10} {:>10} {:>16.2f} {:>12.2f} {:>12.2f} {:>9.1f}x {:>8}".format(
+      num_mentions, len(gold), muc_b_cubed_ms, dense_ceafe_ms, ceafe_ms, dense_ceafe_ms / ceafe_ms, "yes" if same else "NO"))
@@ -2,54 +2,130 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import argparse
+import multiprocessing
+import os
+import zlib
+
 import numpy as np
 import tensorflow as tf
-import tensorflow_hub as hub
 import h5py
 import json
-import sys
 
-def build_elmo():
+import lm_providers
+
+def build_elmo(module_path=lm_providers.DEFAULT_ELMO_MODULE):
   token_ph = tf.placeholder(tf.string, [None, None])
   len_ph = tf.placeholder(tf.int32, [None])
-  elmo_module = hub.Module("https://tfhub.dev/google/elmo/2")
-  lm_embeddings = elmo_module(
-      inputs={"tokens": token_ph, "sequence_len": len_ph},
-      signature="tokens", as_dict=True)
-  word_emb = lm_embeddings["word_emb"]
-  lm_emb = tf.stack([tf.concat([word_emb, word_emb], -1),
-                     lm_embeddings["lstm_outputs1"],
-                     lm_embeddings["lstm_outputs2"]], -1)
+  lm_emb = lm_providers.elmo_lm_emb(module_path, token_ph, len_ph)
   return token_ph, len_ph, lm_emb
 
-def cache_dataset(data_path, session, token_ph, len_ph, lm_emb, out_file):
-  with open(data_path) as in_file:
-    for doc_num, line in enumerate(in_file.readlines()):
-      example = json.loads(line)
-      sentences = example["sentences"]
-      max_sentence_length = max(len(s) for s in sentences)
-      tokens = [[""] * max_sentence_length for _ in sentences]
-      text_len = np.array([len(s) for s in sentences])
-      for i, sentence in enumerate(sentences):
-        for j, word in enumerate(sentence):
-          tokens[i][j] = word
-      tokens = np.array(tokens)
-      tf_lm_emb = session.run(lm_emb, feed_dict={
-          token_ph: tokens,
-          len_ph: text_len
-      })
-      file_key = example["doc_key"].replace("/", ":")
-      group = out_file.create_group(file_key)
-      for i, (e, l) in enumerate(zip(tf_lm_emb, text_len)):
-        e = e[:l, :, :]
-        group[str(i)] = e
-      if doc_num % 10 == 0:
-        print("Cached {} documents in {}".format(doc_num + 1, data_path))
+def shard_path(output_path, shard):
+  return "{}.shard{}".format(output_path, shard)
 
-if __name__ == "__main__":
-  token_ph, len_ph, lm_emb = build_elmo()
-  with tf.Session() as session:
+def document_shard(doc_key, num_shards):
+  # Stable across runs, so an interrupted run resumes with the same assignment of documents to shards.
+  return zlib.crc32(doc_key.encode("utf-8")) % num_shards
+
+def read_documents(input_paths, num_shards, shard, done_keys):
+  for input_path in input_paths:
+    with open(input_path) as input_file:
+      for line in input_file:
+        example = json.loads(line)
+        file_key = example["doc_key"].replace("/", ":")
+        if document_shard(file_key, num_shards) == shard and file_key not in done_keys:
+          yield file_key, example["sentences"]
+
+def sentence_batches(sentences, batch_tokens):
+  # Groups (document, sentence) pairs of similar length, so batches have little padding. Each batch has at most
+  # batch_tokens tokens including padding (or a single sentence if it is longer).
+  sentences = sorted(sentences, key=lambda s: len(s[2]))
+  batch = []
+  for s in sentences:
+    if batch and len(s[2]) * (len(batch) + 1) > batch_tokens:
+      yield batch
+      batch = []
+    batch.append(s)
+  if batch:
+    yield batch
+
+def write_document(out_file, file_key, sentences_emb, dtype, compression):
+  # One contiguous [num_words, lm_size, lm_layers] dataset per document (see lm_providers.HDF5LMProvider).
+  words_emb = np.concatenate(sentences_emb, 0).astype(dtype)
+  if compression:
+    # Chunks of at most 64 words, so reading a few sentences does not decompress the whole document.
+    chunks = (min(len(words_emb), 64),) + words_emb.shape[1:]
+    dataset = out_file.create_dataset(file_key, data=words_emb, chunks=chunks, compression=compression)
+  else:
+    dataset = out_file.create_dataset(file_key, data=words_emb)
+  dataset.attrs["sentence_lengths"] = np.array([len(e) for e in sentences_emb])
+
+def cache_shard(args, shard):
+  config = tf.ConfigProto(intra_op_parallelism_threads=args.threads, inter_op_parallelism_threads=args.threads)
+  token_ph, len_ph, lm_emb = build_elmo(args.module)
+  with tf.Session(config=config) as session:
     session.run(tf.global_variables_initializer())
-    with h5py.File("elmo_cache.hdf5", "w") as out_file:
-      for json_filename in sys.argv[1:]:
-        cache_dataset(json_filename, session, token_ph, len_ph, lm_emb, out_file)
+    # Documents already in the shard file come from an interrupted run and are skipped.
+    with h5py.File(shard_path(args.output, shard), "a") as out_file:
+      documents = read_documents(args.input_paths, args.shards, shard, set(out_file.keys()))
+      num_cached = 0
+      while True:
+        # Sentences of up to buffer_documents documents are batched together.
+        buffered = [d for _, d in zip(range(args.buffer_documents), documents)]
+        if not buffered:
+          break
+        sentences_emb = [[None] * len(sentences) for _, sentences in buffered]
+        sentences = [(d, i, s) for d, (_, doc_sentences) in enumerate(buffered) for i, s in enumerate(doc_sentences)]
+        for batch in sentence_batches(sentences, args.batch_tokens):
+          max_sentence_length = max(len(s) for _, _, s in batch)
+          tokens = np.array([s + [""] * (max_sentence_length - len(s)) for _, _, s in batch])
+          text_len = np.array([len(s) for _, _, s in batch])
+          tf_lm_emb = session.run(lm_emb, feed_dict={
+              token_ph: tokens,
+              len_ph: text_len
+          })
+          for (d, i, _), e, l in zip(batch, tf_lm_emb, text_len):
+            sentences_emb[d][i] = e[:l, :, :]
+        for (file_key, _), doc_sentences_emb in zip(buffered, sentences_emb):
+          write_document(out_file, file_key, doc_sentences_emb, args.dtype, args.compression)
+        out_file.flush()
+        num_cached += len(buffered)
+        print("Shard {}: cached {} documents".format(shard, num_cached))
+
+def link_shards(output_path, num_shards):
+  # The output file only holds external links to the documents of each shard file, so it reads like a single cache.
+  with h5py.File(output_path, "a") as out_file:
+    for shard in range(num_shards):
+      path = shard_path(output_path, shard)
+      with h5py.File(path, "r") as shard_file:
+        for file_key in shard_file.keys():
+          if file_key not in out_file:
+            out_file[file_key] = h5py.ExternalLink(os.path.basename(path), file_key)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Caches ELMo features of .jsonlines documents.")
+  parser.add_argument("input_paths", nargs="+")
+  parser.add_argument("--output", default="elmo_cache.hdf5")
+  parser.add_argument("--dtype", default="float32", choices=["float16", "float32"],
+                      help="float16 halves the size of the cache and of each read.")
+  parser.add_argument("--module", default=lm_providers.DEFAULT_ELMO_MODULE, help="TF-Hub handle or local path of ELMo.")
+  parser.add_argument("--batch_tokens", type=int, default=4096, help="Maximum padded tokens per ELMo batch.")
+  parser.add_argument("--buffer_documents", type=int, default=64, help="Documents whose sentences are batched together.")
+  parser.add_argument("--shards", type=int, default=1, help="Number of parallel workers, each writing its own shard file.")
+  parser.add_argument("--threads", type=int, default=0, help="TensorFlow threads per worker (0 lets TensorFlow decide).")
+  parser.add_argument("--compression", default=None, choices=["gzip", "lzf"],
+                      help="Compressed datasets are chunked, and cannot be memory-mapped by lm_mmap.")
+  args = parser.parse_args()
+
+  if args.shards == 1:
+    cache_shard(args, 0)
+  else:
+    # Workers are forked before any TensorFlow session exists in this process.
+    workers = [multiprocessing.Process(target=cache_shard, args=(args, shard)) for shard in range(args.shards)]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+    if any(worker.exitcode != 0 for worker in workers):
+      raise RuntimeError("A worker failed. Rerun the same command to resume.")
+  link_shards(args.output, args.shards)
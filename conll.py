@@ -11,6 +11,8 @@ import subprocess
 import operator
 import collections
 
+import conll_scorer
+
 BEGIN_DOCUMENT_REGEX = re.compile(r"#begin document \((.*)\); part (\d+)")
 COREF_RESULTS_REGEX = re.compile(r".*Coreference: Recall: \([0-9.]+ / [0-9.]+\) ([0-9.]+)%\tPrecision: \([0-9.]+ / [0-9.]+\) ([0-9.]+)%\tF1: ([0-9.]+)%.*", re.DOTALL)
 
@@ -74,7 +76,9 @@ def output_conll(input_file, output_file, predictions):
       word_index += 1
 
 def official_conll_eval(gold_path, predicted_path, metric, official_stdout=False):
-  cmd = ["conll-2012/scorer/v8.01/scorer.pl", metric, gold_path, predicted_path, "none"]
+  # Runs the perl scorer, which needs its lib/CorScorer.pm next to scorer.pl. evaluate_conll uses conll_scorer instead.
+  cmd = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "conll-2012_score", "scorer", "v8.01", "scorer.pl"),
+         metric, gold_path, predicted_path, "none"]
   process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
   stdout, stderr = process.communicate()
   process.wait()
@@ -104,4 +108,4 @@ def evaluate_conll(gold_path, predictions, official_stdout=False):
     with open(gold_path, "r") as gold_file:
       output_conll(gold_file, prediction_file, predictions)
     print("Predicted conll file: {}".format(prediction_file.name))
-  return { m: official_conll_eval(gold_file.name, prediction_file.name, m, official_stdout) for m in ("muc", "bcub", "ceafe") }
+  return conll_scorer.score(gold_file.name, prediction_file.name, official_stdout)
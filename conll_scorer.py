@@ -0,0 +1,160 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+import collections
+
+import numpy as np
+import scipy.sparse
+
+import metrics
+
+# In-process version of the muc, bcub and ceafe metrics of the official CoNLL-2012 scorer (v8.01, CorScorer.pm), checked
+# against the expected results of its test cases in conll-2012_score/scorer/v8.01/test.
+
+BEGIN_DOCUMENT_REGEX = re.compile(r"#\s*begin document (.*)$")
+SINGLE_WORD_MENTION_REGEX = re.compile(r"\((\d+)\)")
+MENTION_START_REGEX = re.compile(r"\((\d+)")
+MENTION_END_REGEX = re.compile(r"(\d+)\)")
+
+METRICS = ("muc", "bcub", "ceafe")
+
+
+def read_documents(path):
+  """
+  Reads the coreference column (the last one) of a CoNLL file. Words are numbered from the start of each document.
+  :return: OrderedDict from document name (the rest of its "#begin document" line) to its entities, as lists of
+           (start, end) mentions ordered by entity id.
+  """
+  documents = collections.OrderedDict()
+  with open(path) as f:
+    for line in f:
+      begin_match = BEGIN_DOCUMENT_REGEX.match(line.strip())
+      if begin_match:
+        entities = collections.defaultdict(list)
+        open_mentions = collections.defaultdict(list)
+        documents[begin_match.group(1)] = entities
+        word_index = 0
+        continue
+      row = line.split()
+      if len(row) == 0 or row[0].startswith("#"):
+        continue
+      coref = row[-1]
+      # Same order as CorScorer: single word mentions, then starts, then ends.
+      for entity_id in SINGLE_WORD_MENTION_REGEX.findall(coref):
+        entities[int(entity_id)].append((word_index, word_index))
+      coref = SINGLE_WORD_MENTION_REGEX.sub("", coref)
+      for entity_id in MENTION_START_REGEX.findall(coref):
+        open_mentions[int(entity_id)].append(word_index)
+      coref = MENTION_START_REGEX.sub("", coref)
+      for entity_id in MENTION_END_REGEX.findall(coref):
+        entities[int(entity_id)].append((open_mentions[int(entity_id)].pop(), word_index))
+      word_index += 1
+  return collections.OrderedDict((name, [entities[i] for i in sorted(entities)]) for name, entities in documents.items())
+
+
+class ContingencyTable(object):
+  """
+  Mention overlaps of the key (gold) and response (predicted) entities of a document. Each mention must belong to at
+  most one entity on each side, which remove_repeated_mentions ensures.
+  """
+  def __init__(self, predicted, gold):
+    self.gold_sizes = np.array([len(c) for c in gold], dtype=np.int64) # [num_gold]
+    self.predicted_sizes = np.array([len(c) for c in predicted], dtype=np.int64) # [num_predicted]
+    gold_mentions = np.array([m for c in gold for m in c], dtype=np.int64).reshape([-1, 2])
+    predicted_mentions = np.array([m for c in predicted for m in c], dtype=np.int64).reshape([-1, 2])
+    gold_clusters = np.repeat(np.arange(len(gold)), self.gold_sizes)
+    predicted_clusters = np.repeat(np.arange(len(predicted)), self.predicted_sizes)
+
+    # Mentions present on both sides, joined on their position in the sorted union of mentions.
+    _, mention_ids = np.unique(np.concatenate([gold_mentions, predicted_mentions]), axis=0, return_inverse=True)
+    mention_ids = mention_ids.reshape([-1])
+    num_mentions = mention_ids.max() + 1 if len(mention_ids) > 0 else 0
+    gold_cluster_of = np.full(num_mentions, -1, dtype=np.int64)
+    gold_cluster_of[mention_ids[:len(gold_mentions)]] = gold_clusters
+    predicted_ids = mention_ids[len(gold_mentions):]
+    matched = gold_cluster_of[predicted_ids] >= 0
+
+    # counts[g, p] is the number of mentions of gold entity g in predicted entity p.
+    counts = scipy.sparse.coo_matrix((np.ones(matched.sum(), dtype=np.int64),
+                                      (gold_cluster_of[predicted_ids[matched]], predicted_clusters[matched])),
+                                     shape=(len(gold), len(predicted))).tocsr().tocoo()
+    self.gold, self.predicted, self.counts = counts.row, counts.col, counts.data # [num_overlaps]
+
+
+def remove_repeated_mentions(entities):
+  # CorScorer keeps the first occurrence of a mention (in entity order) and drops the others.
+  seen = set()
+  deduplicated = []
+  for entity in entities:
+    entity = [m for m in entity if not (m in seen or seen.add(m))]
+    if len(entity) > 0:
+      deduplicated.append(tuple(entity))
+  return deduplicated
+
+
+def score_document(key_entities, response_entities):
+  """
+  Unlike metrics.CorefEvaluator, the official metrics count singleton entities on both sides.
+  :return: dict from metric to (recall numerator, recall denominator, precision numerator, precision denominator).
+  """
+  key_entities = remove_repeated_mentions(key_entities)
+  response_entities = remove_repeated_mentions(response_entities)
+  table = ContingencyTable(response_entities, key_entities)
+
+  # MUC: each entity scores its mentions minus the number of parts the other side splits it into, where unmatched
+  # mentions are parts of their own, so only matched mentions and overlapping entity pairs count.
+  num_matched = table.counts.sum()
+  muc = (num_matched - len(table.counts), (table.gold_sizes - 1).sum(),
+         num_matched - len(table.counts), (table.predicted_sizes - 1).sum())
+
+  # B-cubed over the response mentions, with every key and response mention in the denominators.
+  squared_counts = table.counts.astype(np.float64) ** 2
+  bcub = ((squared_counts / table.gold_sizes[table.gold]).sum(), table.gold_sizes.sum(),
+          (squared_counts / table.predicted_sizes[table.predicted]).sum(), table.predicted_sizes.sum())
+
+  # CEAFe with phi4 entity similarity.
+  similarities = 2 * table.counts / (table.gold_sizes[table.gold] + table.predicted_sizes[table.predicted]).astype(np.float64)
+  similarity = metrics.aligned_similarity(table.gold, table.predicted, similarities,
+                                          len(table.gold_sizes), len(table.predicted_sizes))
+  ceafe = (similarity, len(table.gold_sizes), similarity, len(table.predicted_sizes))
+
+  return {"muc": tuple(float(c) for c in muc), "bcub": tuple(float(c) for c in bcub), "ceafe": tuple(float(c) for c in ceafe)}
+
+
+def get_scores(counts):
+  # Recall, precision and F1 in percent, as printed by the official scorer.
+  recall_num, recall_den, precision_num, precision_den = counts
+  recall = recall_num / recall_den if recall_den > 0 else 0
+  precision = precision_num / precision_den if precision_den > 0 else 0
+  f1 = 2 * recall * precision / (recall + precision) if recall + precision > 0 else 0
+  return { "r": 100 * recall, "p": 100 * precision, "f": 100 * f1 }
+
+
+def format_scores(counts):
+  recall_num, recall_den, precision_num, precision_den = counts
+  scores = get_scores(counts)
+  return "Coreference: Recall: ({:g} / {:g}) {:.2f}%\tPrecision: ({:g} / {:g}) {:.2f}%\tF1: {:.2f}%".format(
+    round(recall_num, 2), recall_den, scores["r"], round(precision_num, 2), precision_den, scores["p"], scores["f"])
+
+
+def score(key_path, response_path, official_stdout=False):
+  """
+  Scores every document of the key file (a document missing from the response counts as having no entities) and adds
+  up the counts of all documents, like scorer.pl with the "none" document name.
+  :return: dict from metric to its "r", "p" and "f" in percent.
+  """
+  key_documents = read_documents(key_path)
+  response_documents = read_documents(response_path)
+  document_counts = [score_document(key_entities, response_documents.get(name, []))
+                     for name, key_entities in key_documents.items()]
+
+  results = {}
+  for metric in METRICS:
+    counts = tuple(float(c) for c in np.sum([c[metric] for c in document_counts], axis=0)) if document_counts else (0, 0, 0, 0)
+    if official_stdout:
+      print("Official result for {}".format(metric))
+      print(format_scores(counts))
+    results[metric] = get_scores(counts)
+  return results
@@ -1,8 +1,10 @@
 #include <map>
 
+#include "extract_spans.h"
 #include "tensorflow/core/framework/op.h"
 #include "tensorflow/core/framework/shape_inference.h"
 #include "tensorflow/core/framework/op_kernel.h"
+#include "tensorflow/core/util/work_sharder.h"
 
 using namespace tensorflow;
 
@@ -43,86 +45,22 @@ public:
                                                      &output_span_indices_tensor));
     TTypes<int32>::Matrix output_span_indices = output_span_indices_tensor->matrix<int32>();
 
-    std::vector<std::vector<int>> sorted_input_span_indices(num_sentences,
-                                                            std::vector<int>(num_input_spans));
-    for (int i = 0; i < num_sentences; i++) {
-      std::iota(sorted_input_span_indices[i].begin(), sorted_input_span_indices[i].end(), 0);
-      std::sort(sorted_input_span_indices[i].begin(), sorted_input_span_indices[i].end(),
-                [&span_scores, &i](int j1, int j2) {
-                  return span_scores(i, j2) < span_scores(i, j1);
-                });
-    }
-
-    for (int l = 0; l < num_sentences; l++) {
-      std::vector<int> top_span_indices;
-      std::unordered_map<int, int> end_to_earliest_start;
-      std::unordered_map<int, int> start_to_latest_end;
-
-      int current_span_index = 0,
-          num_selected_spans = 0;
-      while (num_selected_spans < num_output_spans(l) && current_span_index < num_input_spans) {
-        int i = sorted_input_span_indices[l][current_span_index];
-        bool any_crossing = false;
-        const int start = candidate_starts(l, i);
-        const int end = candidate_ends(l, i);
-        for (int j = start; j <= end; ++j) {
-          auto latest_end_iter = start_to_latest_end.find(j);
-          if (latest_end_iter != start_to_latest_end.end() && j > start && latest_end_iter->second > end) {
-            // Given (), exists [], such that ( [ ) ]
-            any_crossing = true;
-            break;
-          }
-          auto earliest_start_iter = end_to_earliest_start.find(j);
-          if (earliest_start_iter != end_to_earliest_start.end() && j < end && earliest_start_iter->second < start) {
-            // Given (), exists [], such that [ ( ] )
-            any_crossing = true;
-            break;
-          }
-        }
-        if (!any_crossing) {
-          if (_sort_spans) {
-            top_span_indices.push_back(i);
-          } else {
-            output_span_indices(l, num_selected_spans) = i;
-          }
-          ++num_selected_spans;
-          // Update data struct.
-          auto latest_end_iter = start_to_latest_end.find(start);
-          if (latest_end_iter == start_to_latest_end.end() || end > latest_end_iter->second) {
-            start_to_latest_end[start] = end;
-          }
-          auto earliest_start_iter = end_to_earliest_start.find(end);
-          if (earliest_start_iter == end_to_earliest_start.end() || start < earliest_start_iter->second) {
-            end_to_earliest_start[end] = start;
-          }
-        }
-        ++current_span_index;
+    // Rows are independent, so they are sharded over the intra-op thread pool. Each shard reuses one set of scratch
+    // buffers for all of its rows.
+    auto extract_rows = [&](int64 begin, int64 end) {
+      coref::ExtractSpansScratch scratch;
+      for (int64 l = begin; l < end; l++) {
+        coref::ExtractSpans(span_scores.data() + l * num_input_spans,
+                            candidate_starts.data() + l * num_input_spans,
+                            candidate_ends.data() + l * num_input_spans,
+                            num_input_spans, num_output_spans(l), max_sentence_length, _sort_spans,
+                            output_span_indices.data() + l * max_num_output_spans, max_num_output_spans, &scratch);
       }
-      // Sort and populate selected span indices.
-      if (_sort_spans) {
-        std::sort(top_span_indices.begin(), top_span_indices.end(),
-                  [&candidate_starts, &candidate_ends, &l] (int i1, int i2) {
-                    if (candidate_starts(l, i1) < candidate_starts(l, i2)) {
-                      return true;
-                    } else if (candidate_starts(l, i1) > candidate_starts(l, i2)) {
-                      return false;
-                    } else if (candidate_ends(l, i1) < candidate_ends(l, i2)) {
-                      return true;
-                    } else if (candidate_ends(l, i1) > candidate_ends(l, i2)) {
-                      return false;
-                    } else {
-                      return i1 < i2;
-                    }
-                  });
-        for (int i = 0; i < num_output_spans(l); ++i) {
-          output_span_indices(l, i) = top_span_indices[i];
-        }
-      }
-      // Pad with the first span index.
-      for (int i = num_selected_spans; i < max_num_output_spans; ++i) {
-        output_span_indices(l, i) = output_span_indices(l, 0);
-      }
-    }
+    };
+    // Roughly the heap construction and the crossing checks of a row.
+    const int64 cost_per_row = 10 * static_cast<int64>(num_input_spans) + max_sentence_length;
+    auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+    Shard(worker_threads->num_threads, worker_threads->workers, num_sentences, cost_per_row, extract_rows);
   }
 private:
   bool _sort_spans;
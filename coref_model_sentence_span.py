@@ -4,6 +4,7 @@ from __future__ import print_function
 #-*-encoding:utf-8-*-
 
 import os
+import functools
 import operator
 import random
 import math
@@ -11,12 +12,12 @@ import json
 import threading
 import numpy as np
 import tensorflow as tf
-import tensorflow_hub as hub
-import h5py
 
 import util
 import coref_ops
 import conll
+import decoding
+import lm_providers
 import metrics
 import tools
 import re
@@ -28,18 +29,32 @@ NUM = re.compile(r'\d{4}')
 
 
 class CorefModel(object):
-  def __init__(self, config):
+  def __init__(self, config, record_linear_inputs=False):
     self.config = config
     self.context_embeddings = util.EmbeddingDictionary(config["context_embeddings"])
     self.head_embeddings = util.EmbeddingDictionary(config["head_embeddings"], maybe_cache=self.context_embeddings)
     self.char_embedding_size = config["char_embedding_size"]
     self.char_dict = util.load_char_dict(config["char_vocab_path"])
     self.max_span_width = config["max_span_width"]
+    if config["span_extraction"] not in ("kernel", "tf"):
+      raise ValueError("Unknown span_extraction: {}".format(config["span_extraction"]))
+    if config["span_extraction"] == "tf" and not 1 <= config["span_extraction_pool_ratio"] <= 5:
+      # The pool must hold at least k candidates, and its crossing matrix grows with the square of the ratio.
+      raise ValueError("span_extraction_pool_ratio must be between 1 and 5, got {}.".format(config["span_extraction_pool_ratio"]))
+    # Mention, fast and slow antecedent scoring can run in reduced precision at inference. Scores are cast back to
+    # float32 before pruning, softmax and logsumexp.
+    self.scoring_dtype = tf.as_dtype(config["inference_dtype"])
+    self.scoring_getter = util.cast_variables_getter(self.scoring_dtype) if self.scoring_dtype != tf.float32 else None
+    quantized_weights = None
+    if config["quantized_weights_path"]:
+      # 8-bit mention and antecedent scoring layers, written by quantize.py.
+      if self.scoring_dtype != tf.float32:
+        raise ValueError("Quantized weights require inference_dtype = float32.")
+      quantized_weights = util.load_quantized_weights(config["quantized_weights_path"])
+    # Linear layers of the scoring ffnns. quantize.py records their inputs with record_linear_inputs.
+    self.scoring_linear = util.Linear(quantized_weights, record_inputs=record_linear_inputs)
     self.genres = { g:i for i,g in enumerate(config["genres"]) }
-    if config["lm_path"]:
-      self.lm_file = h5py.File(self.config["lm_path"], "r")
-    else:
-      self.lm_file = None
+    self.lm_provider = lm_providers.get_lm_provider(config)
     self.lm_layers = self.config["lm_layers"]
     self.lm_size = self.config["lm_size"]
     self.eval_data = None # Load eval data lazily.
@@ -59,6 +74,8 @@ class CorefModel(object):
     input_props.append((tf.int32, [None])) # Cluster ids.
     input_props.append((tf.int32, [None]))  # sentence_start.
     input_props.append((tf.int32, [None]))  # sentence_end.
+    input_props.append((tf.int32, [None, 4])) # Teacher antecedent pairs (mention start, mention end, antecedent start, antecedent end).
+    input_props.append((tf.float32, [None])) # Teacher antecedent scores.
 
 
     self.queue_input_tensors = [tf.placeholder(dtype, shape) for dtype, shape in input_props]
@@ -68,6 +85,14 @@ class CorefModel(object):
     self.input_tensors = queue.dequeue()
 
     self.predictions, self.loss = self.get_predictions_and_loss(*self.input_tensors)
+    # Top span boundaries and predicted antecedents only, for callers that just decode clusters.
+    self.top_span_predictions = self.get_top_span_predictions(*self.predictions[3:])
+
+    if self.config["char_embedding_size"] > 0:
+      # Standalone char CNN over a batch of words, used to fill a feature_cache.StaticFeatureCache at inference.
+      self.word_char_index = tf.placeholder(tf.int32, [None, None])
+      with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+        self.word_char_emb = self.get_char_cnn_emb(self.word_char_index) # [num_words, emb]
     self.global_step = tf.Variable(0, name="global_step", trainable=False)
     self.reset_global_step = tf.assign(self.global_step, 0)
     learning_rate = tf.train.exponential_decay(self.config["learning_rate"], self.global_step,
@@ -108,18 +133,6 @@ class CorefModel(object):
     session.run(tf.global_variables_initializer())
     saver.restore(session, checkpoint_path)
 
-  def load_lm_embeddings(self, doc_key):
-    if self.lm_file is None:
-      return np.zeros([0, 0, self.lm_size, self.lm_layers])
-    file_key = doc_key.replace("/", ":")
-    group = self.lm_file[file_key]
-    num_sentences = len(list(group.keys()))
-    sentences = [group[str(i)][...] for i in range(num_sentences)]
-    lm_emb = np.zeros([num_sentences, max(s.shape[0] for s in sentences), self.lm_size, self.lm_layers])
-    for i, s in enumerate(sentences):
-      lm_emb[i, :s.shape[0], :, :] = s
-    return lm_emb
-
   def sentence_start_end_index(self, sentences):
     """
     :param sentences: sentences list example: [['i', 'like'], ['cat']]
@@ -155,7 +168,7 @@ class CorefModel(object):
       starts, ends, labels = [], [], []
     return np.array(starts), np.array(ends), np.array([label_dict[c] for c in labels])
 
-  def tensorize_example(self, example, is_training):
+  def tensorize_example(self, example, is_training, lookup_embeddings=True):
     clusters = example["clusters"]
     gold_mentions = sorted(tuple(m) for m in util.flatten(clusters))
     # print('gold_mentions', gold_mentions)
@@ -196,9 +209,9 @@ class CorefModel(object):
     for i, sentence in enumerate(sentences):
       for j, word in enumerate(sentence):
         tokens[i][j] = word
-        context_word_emb[i, j] = self.context_embeddings[word]
-
-        head_word_emb[i, j] = self.head_embeddings[word]
+        if lookup_embeddings: # Otherwise filled from a feature_cache.StaticFeatureCache.
+          context_word_emb[i, j] = self.context_embeddings[word]
+          head_word_emb[i, j] = self.head_embeddings[word]
         char_index[i, j, :len(word)] = [self.char_dict[c] for c in word]
     tokens = np.array(tokens)
 
@@ -213,10 +226,16 @@ class CorefModel(object):
     gold_starts, gold_ends = self.tensorize_mentions(gold_mentions)
     sentence_index_start, sentence_index_end = self.sentence_start_end_index(sentences)
 
-    lm_emb = self.load_lm_embeddings(doc_key)
+    # Windows of a longer document (see sliding_window.py) only load the LM embeddings of their own sentences.
+    lm_emb = self.lm_provider.load_lm_embeddings(doc_key, example.get("sentence_offset", 0), len(sentences))
+
+    # Antecedent scores of a teacher model for distillation, added by distill.py.
+    teacher_antecedents = np.array(example.get("teacher_antecedents", []), dtype=np.float32).reshape([-1, 5])
+    teacher_pairs = teacher_antecedents[:, :4].astype(np.int32)
+    teacher_scores = teacher_antecedents[:, 4]
 
     # example_tensors = (tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids)
-    example_tensors = (tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end)
+    example_tensors = (tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end, teacher_pairs, teacher_scores)
 
 
     if is_training and len(sentences) > self.config["max_training_sentences"]:
@@ -224,7 +243,7 @@ class CorefModel(object):
     else:
       return example_tensors
 
-  def truncate_example(self, tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end):
+  def truncate_example(self, tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end, teacher_pairs, teacher_scores):
     max_training_sentences = self.config["max_training_sentences"]
     num_sentences = context_word_emb.shape[0]
     assert num_sentences > max_training_sentences
@@ -257,7 +276,12 @@ class CorefModel(object):
 
     cluster_ids = cluster_ids[gold_spans]
 
-    return tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end
+    # Teacher pairs are kept only if both spans are inside the truncated document.
+    teacher_spans = np.logical_and(teacher_pairs >= word_offset, teacher_pairs < word_offset + num_words).all(1)
+    teacher_pairs = teacher_pairs[teacher_spans] - word_offset
+    teacher_scores = teacher_scores[teacher_spans]
+
+    return tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end, teacher_pairs, teacher_scores
 
   def get_candidate_labels(self, candidate_starts, candidate_ends, labeled_starts, labeled_ends, labels):
     same_start = tf.equal(tf.expand_dims(labeled_starts, 1), tf.expand_dims(candidate_starts, 0)) # [num_labeled, num_candidates]
@@ -271,13 +295,16 @@ class CorefModel(object):
     return 1 - (tf.to_float(is_training) * dropout_rate)
 
   def coarse_to_fine_pruning(self, top_span_emb, top_span_mention_scores, c):
+    if self.config["coarse_to_fine_block_size"] > 0 or self.config["max_antecedent_window"] > 0:
+      return self.blocked_coarse_to_fine_pruning(top_span_emb, top_span_mention_scores, c)
+
     k = util.shape(top_span_emb, 0)
     top_span_range = tf.range(k) # [k]
     antecedent_offsets = tf.expand_dims(top_span_range, 1) - tf.expand_dims(top_span_range, 0) # [k, k]
     antecedents_mask = antecedent_offsets >= 1 # [k, k]
     fast_antecedent_scores = tf.expand_dims(top_span_mention_scores, 1) + tf.expand_dims(top_span_mention_scores, 0) # [k, k]
     fast_antecedent_scores += tf.log(tf.to_float(antecedents_mask)) # [k, k]
-    fast_antecedent_scores += self.get_fast_antecedent_scores(top_span_emb) # [k, k]
+    fast_antecedent_scores += tf.to_float(self.get_fast_antecedent_scores(top_span_emb)) # [k, k]
 
     _, top_antecedents = tf.nn.top_k(fast_antecedent_scores, c, sorted=False) # [k, c]
     top_antecedents_mask = util.batch_gather(antecedents_mask, top_antecedents) # [k, c]
@@ -285,6 +312,40 @@ class CorefModel(object):
     top_antecedent_offsets = util.batch_gather(antecedent_offsets, top_antecedents) # [k, c]
     return top_antecedents, top_antecedents_mask, top_fast_antecedent_scores, top_antecedent_offsets
 
+  def blocked_coarse_to_fine_pruning(self, top_span_emb, top_span_mention_scores, c):
+    # Same as coarse_to_fine_pruning, but the fast scores are computed for one block of mentions at a time and only
+    # against spans up to the end of the block, so the [k, k] score, offset and mask matrices are never built. With
+    # max_antecedent_window, each block is also only scored against the window before it, which makes the cost linear in k.
+    k = util.shape(top_span_emb, 0)
+    window = self.config["max_antecedent_window"]
+    block_size = self.config["coarse_to_fine_block_size"] or window
+    source_top_span_emb, target_top_span_emb = self.get_fast_antecedent_emb(top_span_emb) # [k, emb], [k, emb]
+
+    def _prune_block(span_indices, source_emb, mention_scores):
+      # span_indices are consecutive, and empty if there are no top spans.
+      block_start = tf.reduce_sum(span_indices[:1])
+      block_end = block_start + tf.shape(span_indices)[0]
+      antecedents_start = tf.maximum(block_start - window, 0) if window > 0 else 0
+      antecedents_end = tf.maximum(block_end, c) # top_k needs at least c columns.
+      antecedent_offsets = tf.expand_dims(span_indices, 1) - tf.expand_dims(tf.range(antecedents_start, antecedents_end), 0) # [b, a]
+      antecedents_mask = antecedent_offsets >= 1 # [b, a]
+      if window > 0:
+        antecedents_mask = tf.logical_and(antecedents_mask, antecedent_offsets <= window) # [b, a]
+      fast_antecedent_scores = tf.expand_dims(mention_scores, 1) + tf.expand_dims(top_span_mention_scores[antecedents_start:antecedents_end], 0) # [b, a]
+      fast_antecedent_scores += tf.log(tf.to_float(antecedents_mask)) # [b, a]
+      fast_antecedent_scores += tf.to_float(tf.matmul(source_emb, target_top_span_emb[antecedents_start:antecedents_end], transpose_b=True)) # [b, a]
+      top_fast_antecedent_scores, top_antecedents = tf.nn.top_k(fast_antecedent_scores, c, sorted=False) # [b, c]
+      return [top_antecedents + antecedents_start, top_fast_antecedent_scores]
+
+    top_antecedents, top_fast_antecedent_scores = util.blocked_map(_prune_block,
+                                                                   [tf.range(k), source_top_span_emb, top_span_mention_scores],
+                                                                   block_size, [tf.int32, tf.float32]) # [k, c]
+    top_antecedents.set_shape([None, None])
+    top_fast_antecedent_scores.set_shape([None, None])
+    top_antecedent_offsets = tf.expand_dims(tf.range(k), 1) - top_antecedents # [k, c]
+    top_antecedents_mask = top_antecedent_offsets >= 1 # [k, c]
+    return top_antecedents, top_antecedents_mask, top_fast_antecedent_scores, top_antecedent_offsets
+
   def distance_pruning(self, top_span_emb, top_span_mention_scores, c):
     k = util.shape(top_span_emb, 0)
     top_antecedent_offsets = tf.tile(tf.expand_dims(tf.range(c) + 1, 0), [k, 1]) # [k, c]
@@ -296,10 +357,11 @@ class CorefModel(object):
     top_fast_antecedent_scores += tf.log(tf.to_float(top_antecedents_mask)) # [k, c]
     return top_antecedents, top_antecedents_mask, top_fast_antecedent_scores, top_antecedent_offsets
 
-  def get_predictions_and_loss(self, tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end):
+  def get_predictions_and_loss(self, tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, cluster_ids, sentence_index_start, sentence_index_end, teacher_pairs, teacher_scores):
     self.dropout = self.get_dropout(self.config["dropout_rate"], is_training)
     self.lexical_dropout = self.get_dropout(self.config["lexical_dropout_rate"], is_training)
     self.lstm_dropout = self.get_dropout(self.config["lstm_dropout_rate"], is_training)
+    self.scoring_dropout = tf.cast(self.dropout, self.scoring_dtype)
 
     num_sentences = tf.shape(context_word_emb)[0]
     max_sentence_length = tf.shape(context_word_emb)[1]
@@ -308,32 +370,28 @@ class CorefModel(object):
     head_emb_list = [head_word_emb]
 
     if self.config["char_embedding_size"] > 0:
-      char_emb = tf.gather(tf.get_variable("char_embeddings", [len(self.char_dict), self.config["char_embedding_size"]]), char_index) # [num_sentences, max_sentence_length, max_word_length, emb]
-      flattened_char_emb = tf.reshape(char_emb, [num_sentences * max_sentence_length, util.shape(char_emb, 2), util.shape(char_emb, 3)]) # [num_sentences * max_sentence_length, max_word_length, emb]
-      flattened_aggregated_char_emb = util.cnn(flattened_char_emb, self.config["filter_widths"], self.config["filter_size"]) # [num_sentences * max_sentence_length, emb]
-      aggregated_char_emb = tf.reshape(flattened_aggregated_char_emb, [num_sentences, max_sentence_length, util.shape(flattened_aggregated_char_emb, 1)]) # [num_sentences, max_sentence_length, emb]
-      context_emb_list.append(aggregated_char_emb)
-      head_emb_list.append(aggregated_char_emb)
-
-    if not self.lm_file:
-      elmo_module = hub.Module("https://tfhub.dev/google/elmo/2")
-      lm_embeddings = elmo_module(
-          inputs={"tokens": tokens, "sequence_len": text_len},
-          signature="tokens", as_dict=True)
-      word_emb = lm_embeddings["word_emb"]  # [num_sentences, max_sentence_length, 512]
-      lm_emb = tf.stack([tf.concat([word_emb, word_emb], -1),
-                         lm_embeddings["lstm_outputs1"],
-                         lm_embeddings["lstm_outputs2"]], -1)  # [num_sentences, max_sentence_length, 1024, 3]
-    lm_emb_size = util.shape(lm_emb, 2)
-    lm_num_layers = util.shape(lm_emb, 3)
-    with tf.variable_scope("lm_aggregation"):
-      self.lm_weights = tf.nn.softmax(tf.get_variable("lm_scores", [lm_num_layers], initializer=tf.constant_initializer(0.0)))
-      self.lm_scaling = tf.get_variable("lm_scaling", [], initializer=tf.constant_initializer(1.0))
-    flattened_lm_emb = tf.reshape(lm_emb, [num_sentences * max_sentence_length * lm_emb_size, lm_num_layers])
-    flattened_aggregated_lm_emb = tf.matmul(flattened_lm_emb, tf.expand_dims(self.lm_weights, 1)) # [num_sentences * max_sentence_length * emb, 1]
-    aggregated_lm_emb = tf.reshape(flattened_aggregated_lm_emb, [num_sentences, max_sentence_length, lm_emb_size])
-    aggregated_lm_emb *= self.lm_scaling
-    context_emb_list.append(aggregated_lm_emb)
+      flattened_char_index = tf.reshape(char_index, [num_sentences * max_sentence_length, util.shape(char_index, 2)]) # [num_sentences * max_sentence_length, max_word_length]
+      # Repeated words and padding slots have identical characters, so the CNN only runs once per word type.
+      word_types, flattened_word_type_ids = tf.unique(tf.reshape(tokens, [-1])) # [num_types], [num_sentences * max_sentence_length]
+      word_type_positions = tf.unsorted_segment_min(tf.range(num_sentences * max_sentence_length), flattened_word_type_ids, tf.shape(word_types)[0]) # [num_types]
+      word_type_char_emb = self.get_char_cnn_emb(tf.gather(flattened_char_index, word_type_positions)) # [num_types, emb]
+      flattened_aggregated_char_emb = tf.gather(word_type_char_emb, flattened_word_type_ids) # [num_sentences * max_sentence_length, emb]
+      self.aggregated_char_emb = tf.reshape(flattened_aggregated_char_emb, [num_sentences, max_sentence_length, util.shape(flattened_aggregated_char_emb, 1)]) # [num_sentences, max_sentence_length, emb]
+      context_emb_list.append(self.aggregated_char_emb)
+      head_emb_list.append(self.aggregated_char_emb)
+
+    if self.config["use_lm"]:
+      lm_emb = self.lm_provider.get_lm_emb(lm_emb, tokens, text_len, context_word_emb) # [num_sentences, max_sentence_length, lm_size, lm_layers]
+      lm_emb_size = util.shape(lm_emb, 2)
+      lm_num_layers = util.shape(lm_emb, 3)
+      with tf.variable_scope("lm_aggregation"):
+        self.lm_weights = tf.nn.softmax(tf.get_variable("lm_scores", [lm_num_layers], initializer=tf.constant_initializer(0.0)))
+        self.lm_scaling = tf.get_variable("lm_scaling", [], initializer=tf.constant_initializer(1.0))
+      flattened_lm_emb = tf.reshape(lm_emb, [num_sentences * max_sentence_length * lm_emb_size, lm_num_layers])
+      flattened_aggregated_lm_emb = tf.matmul(flattened_lm_emb, tf.expand_dims(self.lm_weights, 1)) # [num_sentences * max_sentence_length * emb, 1]
+      aggregated_lm_emb = tf.reshape(flattened_aggregated_lm_emb, [num_sentences, max_sentence_length, lm_emb_size])
+      aggregated_lm_emb *= self.lm_scaling
+      context_emb_list.append(aggregated_lm_emb)
 
     context_emb = tf.concat(context_emb_list, 2) # [num_sentences, max_sentence_length, emb]
     head_emb = tf.concat(head_emb_list, 2) # [num_sentences, max_sentence_length, emb]
@@ -406,12 +464,16 @@ class CorefModel(object):
     candidate_mention_scores = tf.squeeze(candidate_mention_scores, 1) # [k]
 
     k = tf.to_int32(tf.floor(tf.to_float(tf.shape(context_outputs)[0]) * self.config["top_span_ratio"]))
-    top_span_indices = coref_ops.extract_spans(tf.expand_dims(candidate_mention_scores, 0),
-                                               tf.expand_dims(candidate_starts, 0),
-                                               tf.expand_dims(candidate_ends, 0),
-                                               tf.expand_dims(k, 0),
-                                               util.shape(context_outputs, 0),
-                                               True) # [1, k]
+    if self.config["span_extraction"] == "tf":
+      extract_spans = functools.partial(coref_ops.extract_spans_tf, pool_ratio=self.config["span_extraction_pool_ratio"])
+    else:
+      extract_spans = coref_ops.extract_spans
+    top_span_indices = extract_spans(tf.expand_dims(candidate_mention_scores, 0),
+                                     tf.expand_dims(candidate_starts, 0),
+                                     tf.expand_dims(candidate_ends, 0),
+                                     tf.expand_dims(k, 0),
+                                     util.shape(context_outputs, 0),
+                                     True) # [1, k]
     top_span_indices.set_shape([1, None])
     top_span_indices = tf.squeeze(top_span_indices, 0) # [k]
 
@@ -424,6 +486,8 @@ class CorefModel(object):
     top_span_speaker_ids = tf.gather(speaker_ids, top_span_starts) # [k]
 
     c = tf.minimum(self.config["max_top_antecedents"], k)
+    if self.config["max_antecedent_window"] > 0:
+      c = tf.minimum(self.config["max_antecedent_window"], c)
 
     """Stage 1 competed: k candidate mentions.
     """
@@ -478,8 +542,16 @@ class CorefModel(object):
 
     loss = tf.reduce_sum(loss) # []
 
+    if self.config["distillation_weight"] > 0:
+      loss += self.config["distillation_weight"] * self.distillation_loss(top_span_starts, top_span_ends, top_antecedents, top_antecedents_mask, top_antecedent_scores,
+                                                                          teacher_pairs, teacher_scores, num_words)
+
     return [candidate_starts, candidate_ends, candidate_mention_scores, top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores], loss
 
+  def get_char_cnn_emb(self, char_index):
+    char_emb = tf.gather(tf.get_variable("char_embeddings", [len(self.char_dict), self.config["char_embedding_size"]]), char_index) # [num_words, max_word_length, emb]
+    return util.cnn(char_emb, self.config["filter_widths"], self.config["filter_size"]) # [num_words, emb]
+
   def get_span_emb(self, head_emb, context_outputs, span_starts, span_ends):
     span_emb_list = []
 
@@ -535,8 +607,17 @@ class CorefModel(object):
     return span_emb # [k, emb]
 
   def get_mention_scores(self, span_emb):
-    with tf.variable_scope("mention_scores"):
-      return util.ffnn(span_emb, self.config["ffnn_depth"], self.config["ffnn_size"], 1, self.dropout) # [k, 1]
+    with tf.variable_scope("mention_scores", custom_getter=self.scoring_getter):
+      span_emb = tf.cast(span_emb, self.scoring_dtype) # [k, emb]
+      return tf.to_float(util.ffnn(span_emb, self.config["ffnn_depth"], self.config["ffnn_size"], 1, self.scoring_dropout, linear=self.scoring_linear)) # [k, 1]
+
+  def get_top_span_predictions(self, top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores):
+    # In-graph equivalent of get_predicted_antecedents, so that the [k, c + 1] scores need not be fetched.
+    antecedent_columns = tf.to_int32(tf.argmax(top_antecedent_scores, 1)) - 1 # [k]
+    k = util.shape(top_antecedents, 0)
+    gathered = tf.gather_nd(top_antecedents, tf.stack([tf.range(k), tf.maximum(antecedent_columns, 0)], 1)) # [k]
+    predicted_antecedents = tf.where(antecedent_columns < 0, tf.fill([k], -1), gathered) # [k]
+    return [top_span_starts, top_span_ends, predicted_antecedents]
 
   def softmax_loss(self, antecedent_scores, antecedent_labels):
 
@@ -552,6 +633,39 @@ class CorefModel(object):
 
     return log_norm - marginalized_gold_scores # [k]
 
+  def distillation_loss(self, top_span_starts, top_span_ends, top_antecedents, top_antecedents_mask, top_antecedent_scores, teacher_pairs, teacher_scores, num_words):
+    """
+    Cross-entropy between the antecedent distributions of a teacher model (see distill.py) and of this model, both over
+    the antecedents kept by this model and softened by distillation_temperature. Pairs the teacher did not score get no
+    probability, so mentions the teacher pruned only have the dummy antecedent.
+    """
+    temperature = self.config["distillation_temperature"]
+    k = util.shape(top_antecedents, 0)
+    num_words = tf.to_int64(num_words)
+
+    def _pair_ids(mention_starts, mention_ends, antecedent_starts, antecedent_ends):
+      pair_ids = tf.to_int64(mention_starts)
+      for x in [mention_ends, antecedent_starts, antecedent_ends]:
+        pair_ids = pair_ids * num_words + tf.to_int64(x)
+      return pair_ids
+
+    teacher_pair_ids = _pair_ids(*tf.unstack(teacher_pairs, 4, 1)) # [num_teacher_pairs]
+    antecedent_pair_ids = _pair_ids(tf.expand_dims(top_span_starts, 1), tf.expand_dims(top_span_ends, 1),
+                                    tf.gather(top_span_starts, top_antecedents), tf.gather(top_span_ends, top_antecedents)) # [k, c]
+    num_teacher_pairs = tf.shape(teacher_pair_ids)[0]
+    _, unique_pair_indices = tf.unique(tf.concat([teacher_pair_ids, tf.reshape(antecedent_pair_ids, [-1])], 0)) # [num_teacher_pairs + k * c]
+    # Pairs without a teacher score get the lowest float.
+    unique_teacher_scores = tf.unsorted_segment_max(teacher_scores, unique_pair_indices[:num_teacher_pairs], tf.size(unique_pair_indices))
+    teacher_antecedent_scores = tf.reshape(tf.gather(unique_teacher_scores, unique_pair_indices[num_teacher_pairs:]), tf.shape(top_antecedents)) # [k, c]
+    teacher_antecedent_scores += tf.log(tf.to_float(top_antecedents_mask)) # [k, c]
+    teacher_antecedent_scores = tf.concat([tf.zeros([k, 1]), teacher_antecedent_scores], 1) # [k, c + 1]
+
+    teacher_probs = tf.nn.softmax(teacher_antecedent_scores / temperature) # [k, c + 1]
+    log_probs = tf.nn.log_softmax(top_antecedent_scores / temperature) # [k, c + 1]
+    cross_entropy = tf.where(teacher_probs > 0, teacher_probs * log_probs, tf.zeros_like(log_probs)) # [k, c + 1]
+    # Scaled by temperature^2 so gradients keep the same magnitude across temperatures.
+    return -tf.reduce_sum(cross_entropy) * temperature ** 2 # []
+
   def bucket_distance(self, distances):
     """
     Places the given values (designed for distances) into 10 semi-logscale buckets:
@@ -593,23 +707,51 @@ class CorefModel(object):
     feature_emb = tf.concat(feature_emb_list, 2) # [k, c, emb]
     feature_emb = tf.nn.dropout(feature_emb, self.dropout) # [k, c, emb]
 
-    target_emb = tf.expand_dims(top_span_emb, 1) # [k, 1, emb]
-    similarity_emb = top_antecedent_emb * target_emb # [k, c, emb]
-    target_emb = tf.tile(target_emb, [1, c, 1]) # [k, c, emb]
-
-    pair_emb = tf.concat([target_emb, top_antecedent_emb, similarity_emb, feature_emb], 2) # [k, c, emb]
-
-    with tf.variable_scope("slow_antecedent_scores"):
-      slow_antecedent_scores = util.ffnn(pair_emb, self.config["ffnn_depth"], self.config["ffnn_size"], 1, self.dropout) # [k, c, 1]
-    slow_antecedent_scores = tf.squeeze(slow_antecedent_scores, 2) # [k, c]
+    block_size = self.config["slow_antecedent_block_size"]
+    with tf.variable_scope("slow_antecedent_scores", custom_getter=self.scoring_getter):
+      top_span_emb = tf.cast(top_span_emb, self.scoring_dtype) # [k, emb]
+      top_antecedent_emb = tf.cast(top_antecedent_emb, self.scoring_dtype) # [k, c, emb]
+      feature_emb = tf.cast(feature_emb, self.scoring_dtype) # [k, c, emb]
+
+      # The first layer is linear in [g_i, g_j, g_i * g_j, features], so the g_i and g_j terms are projected once per
+      # span and gathered per pair instead of being recomputed for each of the [k, c] pairs.
+      emb_size = util.shape(top_span_emb, 1)
+      input_weights, input_bias = util.ffnn_input_weights([emb_size, emb_size, emb_size, util.shape(feature_emb, 2)],
+                                                          self.config["ffnn_depth"], self.config["ffnn_size"], 1)
+      target_weights, antecedent_weights, similarity_weights, feature_weights = input_weights
+      target_projection = self.scoring_linear(top_span_emb, *target_weights) + input_bias # [k, emb]
+      antecedent_projection = self.scoring_linear(top_span_emb, *antecedent_weights) # [k, emb]
+
+      def _score_antecedent_pairs(top_span_emb, target_projection, top_antecedents, top_antecedent_emb, feature_emb):
+        similarity_emb = top_antecedent_emb * tf.expand_dims(top_span_emb, 1) # [k, c, emb]
+        pair_projection = tf.expand_dims(target_projection, 1) + tf.gather(antecedent_projection, top_antecedents) # [k, c, emb]
+        flattened_pair_projection = tf.reshape(pair_projection, [-1, util.shape(pair_projection, 2)]) # [k * c, emb]
+        flattened_pair_projection += self.scoring_linear(tf.reshape(similarity_emb, [-1, emb_size]), *similarity_weights) # [k * c, emb]
+        flattened_pair_projection += self.scoring_linear(tf.reshape(feature_emb, [-1, util.shape(feature_emb, 2)]), *feature_weights) # [k * c, emb]
+        pair_scores = util.ffnn_from_input_layer(flattened_pair_projection, self.config["ffnn_depth"], self.config["ffnn_size"], 1, self.scoring_dropout, linear=self.scoring_linear) # [k * c, 1]
+        return tf.reshape(tf.to_float(pair_scores), tf.shape(top_antecedents)) # [k, c]
+
+      block_inputs = [top_span_emb, target_projection, top_antecedents, top_antecedent_emb, feature_emb]
+      if block_size > 0:
+        # Only one block of [block_size, c, emb] pair activations is alive at a time.
+        slow_antecedent_scores, = util.blocked_map(lambda *block: [_score_antecedent_pairs(*block)],
+                                                   block_inputs, block_size, [tf.float32]) # [k, c]
+        slow_antecedent_scores.set_shape([None, None])
+      else:
+        slow_antecedent_scores = _score_antecedent_pairs(*block_inputs) # [k, c]
     return slow_antecedent_scores # [k, c]
 
   def get_fast_antecedent_scores(self, top_span_emb):
-    with tf.variable_scope("src_projection"):
-      source_top_span_emb = tf.nn.dropout(util.projection(top_span_emb, util.shape(top_span_emb, -1)), self.dropout) # [k, emb]
-    target_top_span_emb = tf.nn.dropout(top_span_emb, self.dropout) # [k, emb]
+    source_top_span_emb, target_top_span_emb = self.get_fast_antecedent_emb(top_span_emb) # [k, emb], [k, emb]
     return tf.matmul(source_top_span_emb, target_top_span_emb, transpose_b=True) # [k, k]
 
+  def get_fast_antecedent_emb(self, top_span_emb):
+    top_span_emb = tf.cast(top_span_emb, self.scoring_dtype) # [k, emb]
+    with tf.variable_scope("src_projection", custom_getter=self.scoring_getter):
+      source_top_span_emb = tf.nn.dropout(util.projection(top_span_emb, util.shape(top_span_emb, -1), linear=self.scoring_linear), self.scoring_dropout) # [k, emb]
+    target_top_span_emb = tf.nn.dropout(top_span_emb, self.scoring_dropout) # [k, emb]
+    return source_top_span_emb, target_top_span_emb
+
   def flatten_emb_by_sentence(self, emb, text_len_mask):
     num_sentences = tf.shape(emb)[0]
     max_sentence_length = tf.shape(emb)[1]
@@ -624,6 +766,46 @@ class CorefModel(object):
     return tf.boolean_mask(flattened_emb, tf.reshape(text_len_mask, [num_sentences * max_sentence_length]))
 
   def lstm_contextualize(self, text_emb, text_len, text_len_mask):
+    if self.config["lstm_length_buckets"] > 1:
+      text_outputs = self.bucketed_lstm_contextualize(text_emb, text_len, self.config["lstm_length_buckets"])
+    else:
+      text_outputs = self.contextualize_sentences(text_emb, text_len)
+    return self.flatten_emb_by_sentence(text_outputs, text_len_mask)
+
+  def bucketed_lstm_contextualize(self, text_emb, text_len, num_buckets):
+    # Sorts sentences by length and runs the BiLSTM separately on num_buckets groups of similar length, each padded only
+    # to its own longest sentence, so one long sentence does not make every sentence pay for its LSTM steps.
+    num_sentences = tf.shape(text_emb)[0]
+    max_sentence_length = tf.shape(text_emb)[1]
+    output_size = 2 * self.config["contextualization_size"]
+
+    _, sorted_indices = tf.nn.top_k(text_len, num_sentences) # [num_sentences]
+    sorted_text_emb = tf.gather(text_emb, sorted_indices) # [num_sentences, max_sentence_length, emb]
+    sorted_text_len = tf.gather(text_len, sorted_indices) # [num_sentences]
+
+    bucket_outputs = [None] * num_buckets
+    # The last bucket is never empty, so it is built first and creates the variables.
+    for bucket in reversed(range(num_buckets)):
+      bucket_start = bucket * num_sentences // num_buckets
+      bucket_end = (bucket + 1) * num_sentences // num_buckets
+
+      def _contextualize_bucket(bucket_start=bucket_start, bucket_end=bucket_end):
+        bucket_text_len = sorted_text_len[bucket_start:bucket_end] # [bucket_size]
+        bucket_length = tf.reduce_max(bucket_text_len)
+        outputs = self.contextualize_sentences(sorted_text_emb[bucket_start:bucket_end, :bucket_length], bucket_text_len) # [bucket_size, bucket_length, emb]
+        return tf.pad(outputs, [[0, 0], [0, max_sentence_length - bucket_length], [0, 0]]) # [bucket_size, max_sentence_length, emb]
+
+      with tf.variable_scope(tf.get_variable_scope(), reuse=(bucket < num_buckets - 1)):
+        if bucket == num_buckets - 1:
+          bucket_outputs[bucket] = _contextualize_bucket()
+        else:
+          bucket_outputs[bucket] = tf.cond(bucket_end > bucket_start, _contextualize_bucket,
+                                           lambda: tf.zeros([0, max_sentence_length, output_size]))
+
+    sorted_text_outputs = tf.concat(bucket_outputs, 0) # [num_sentences, max_sentence_length, emb]
+    return tf.gather(sorted_text_outputs, tf.invert_permutation(sorted_indices)) # [num_sentences, max_sentence_length, emb]
+
+  def contextualize_sentences(self, text_emb, text_len):
     num_sentences = tf.shape(text_emb)[0]
 
     current_inputs = text_emb # [num_sentences, max_sentence_length, emb]
@@ -634,16 +816,19 @@ class CorefModel(object):
           cell_fw = util.CustomLSTMCell(self.config["contextualization_size"], num_sentences, self.lstm_dropout)
         with tf.variable_scope("bw_cell"):
           cell_bw = util.CustomLSTMCell(self.config["contextualization_size"], num_sentences, self.lstm_dropout)
-        state_fw = tf.contrib.rnn.LSTMStateTuple(tf.tile(cell_fw.initial_state.c, [num_sentences, 1]), tf.tile(cell_fw.initial_state.h, [num_sentences, 1]))
-        state_bw = tf.contrib.rnn.LSTMStateTuple(tf.tile(cell_bw.initial_state.c, [num_sentences, 1]), tf.tile(cell_bw.initial_state.h, [num_sentences, 1]))
-
-        (fw_outputs, bw_outputs), _ = tf.nn.bidirectional_dynamic_rnn(
-          cell_fw=cell_fw,
-          cell_bw=cell_bw,
-          inputs=current_inputs,
-          sequence_length=text_len,
-          initial_state_fw=state_fw,
-          initial_state_bw=state_bw)
+        if self.config["contextualizer"] == "fused":
+          fw_outputs, bw_outputs = util.fused_bidirectional_rnn(cell_fw, cell_bw, current_inputs, text_len)
+        else:
+          state_fw = tf.contrib.rnn.LSTMStateTuple(tf.tile(cell_fw.initial_state.c, [num_sentences, 1]), tf.tile(cell_fw.initial_state.h, [num_sentences, 1]))
+          state_bw = tf.contrib.rnn.LSTMStateTuple(tf.tile(cell_bw.initial_state.c, [num_sentences, 1]), tf.tile(cell_bw.initial_state.h, [num_sentences, 1]))
+
+          (fw_outputs, bw_outputs), _ = tf.nn.bidirectional_dynamic_rnn(
+            cell_fw=cell_fw,
+            cell_bw=cell_bw,
+            inputs=current_inputs,
+            sequence_length=text_len,
+            initial_state_fw=state_fw,
+            initial_state_bw=state_bw)
 
         text_outputs = tf.concat([fw_outputs, bw_outputs], 2) # [num_sentences, max_sentence_length, emb]
         text_outputs = tf.nn.dropout(text_outputs, self.lstm_dropout)
@@ -652,40 +837,13 @@ class CorefModel(object):
           text_outputs = highway_gates * text_outputs + (1 - highway_gates) * current_inputs
         current_inputs = text_outputs
 
-    return self.flatten_emb_by_sentence(text_outputs, text_len_mask)
+    return text_outputs # [num_sentences, max_sentence_length, emb]
 
   def get_predicted_antecedents(self, antecedents, antecedent_scores):
-    predicted_antecedents = []
-    for i, index in enumerate(np.argmax(antecedent_scores, axis=1) - 1):
-      if index < 0:
-        predicted_antecedents.append(-1)
-      else:
-        predicted_antecedents.append(antecedents[i, index])
-    return predicted_antecedents
+    return decoding.get_predicted_antecedents(antecedents, antecedent_scores)
 
   def get_predicted_clusters(self, top_span_starts, top_span_ends, predicted_antecedents):
-    mention_to_predicted = {}
-    predicted_clusters = []
-    for i, predicted_index in enumerate(predicted_antecedents):
-      if predicted_index < 0:
-        continue
-      assert i > predicted_index
-      predicted_antecedent = (int(top_span_starts[predicted_index]), int(top_span_ends[predicted_index]))
-      if predicted_antecedent in mention_to_predicted:
-        predicted_cluster = mention_to_predicted[predicted_antecedent]
-      else:
-        predicted_cluster = len(predicted_clusters)
-        predicted_clusters.append([predicted_antecedent])
-        mention_to_predicted[predicted_antecedent] = predicted_cluster
-
-      mention = (int(top_span_starts[i]), int(top_span_ends[i]))
-      predicted_clusters[predicted_cluster].append(mention)
-      mention_to_predicted[mention] = predicted_cluster
-
-    predicted_clusters = [tuple(pc) for pc in predicted_clusters]
-    mention_to_predicted = { m:predicted_clusters[i] for m,i in mention_to_predicted.items() }
-
-    return predicted_clusters, mention_to_predicted
+    return decoding.get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
 
   def evaluate_coref(self, top_span_starts, top_span_ends, predicted_antecedents, gold_clusters, evaluator):
     gold_clusters = [tuple(tuple(m) for m in gc) for gc in gold_clusters]
@@ -716,7 +874,7 @@ class CorefModel(object):
     coref_evaluator = metrics.CorefEvaluator()
 
     for example_num, (tensorized_example, example) in enumerate(self.eval_data):
-      tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, _ = tensorized_example
+      tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, _, _, _, _, _ = tensorized_example
 
       # print('tokens', tokens, tokens.shape)
       # print('context_word_emb', context_word_emb, context_word_emb.shape)
@@ -724,16 +882,10 @@ class CorefModel(object):
       # print('lm', lm_emb, lm_emb.shape)
 
       feed_dict = {i:t for i,t in zip(self.input_tensors, tensorized_example)}
-      candidate_starts, candidate_ends, candidate_mention_scores, top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores = session.run(self.predictions, feed_dict=feed_dict)
+      top_span_starts, top_span_ends, predicted_antecedents = session.run(self.top_span_predictions, feed_dict=feed_dict)
 
-      # print('candidate_starts', candidate_starts)
-      # print('end', candidate_ends)
       # print('top_span_starts', top_span_starts, top_span_ends.shape)
       # print('top_span_end', top_span_ends, top_span_ends.shape)
-      # print('top_antecedent_scores', top_antecedent_scores)
-
-
-      predicted_antecedents = self.get_predicted_antecedents(top_antecedents, top_antecedent_scores)
 
       # print('predicted_antecedents', predicted_antecedents)
 
@@ -786,10 +938,10 @@ class CorefModel(object):
     coref_evaluator = metrics.CorefEvaluator()
 
     for example_num, (tensorized_example, example) in enumerate(self.eval_data):
-      tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, _ = tensorized_example
+      tokens, context_word_emb, head_word_emb, lm_emb, char_index, text_len, speaker_ids, genre, is_training, gold_starts, gold_ends, _, _, _, _, _ = tensorized_example
       print("gold_start:", gold_starts)
       print("gold_end:", gold_ends)
-      print(sum(tokens, []))
+      print(sum(tokens.tolist(), []))
 
       feed_dict = {i:t for i,t in zip(self.input_tensors, tensorized_example)}
       candidate_starts, candidate_ends, candidate_mention_scores, top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores = session.run(self.predictions, feed_dict=feed_dict)
@@ -2,10 +2,98 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
 import tensorflow as tf
 from tensorflow.python import pywrap_tensorflow
 
-coref_op_library = tf.load_op_library("./coref_kernels.so")
+import span_extraction
+import util
+
+def extract_spans_py_func(span_scores, candidate_starts, candidate_ends, num_output_spans, max_sentence_length, sort_spans):
+  # Same signature and output as the ExtractSpans op, computed by span_extraction.py on the host.
+  output_span_indices = tf.py_func(lambda *inputs: span_extraction.extract_spans(*inputs, sort_spans=sort_spans),
+                                   [span_scores, candidate_starts, candidate_ends, num_output_spans, max_sentence_length],
+                                   tf.int32, stateful=False)
+  output_span_indices.set_shape([None, None])
+  return output_span_indices
+
+def extract_spans_tf(span_scores, candidate_starts, candidate_ends, num_output_spans, max_sentence_length, sort_spans, pool_ratio):
+  """
+  Same selection as the ExtractSpans op from TensorFlow ops only, so it runs on any device and can be XLA-compiled.
+  Only the pool_ratio * max(num_output_spans) best candidates of each row are considered, which gives the same result
+  unless the greedy selection needs to look further down the ranking to select enough spans. Such rows are reported on
+  stderr. Each round of the selection multiplies [pool_size, pool_size] matrices, so time and memory grow
+  quadratically with num_output_spans.
+  """
+  num_input_spans = tf.shape(span_scores)[1]
+  max_num_output_spans = tf.reduce_max(num_output_spans)
+  pool_size = tf.minimum(pool_ratio * max_num_output_spans, num_input_spans)
+  _, pool_indices = tf.nn.top_k(span_scores, pool_size) # [num_rows, pool_size] (ties ranked by lower index)
+  pool_starts = util.batch_gather(candidate_starts, pool_indices) # [num_rows, pool_size]
+  pool_ends = util.batch_gather(candidate_ends, pool_indices) # [num_rows, pool_size]
+
+  # blocking[r, i, j] is 1 if the higher ranked span j (j < i) crosses span i.
+  starts_i, ends_i = tf.expand_dims(pool_starts, 2), tf.expand_dims(pool_ends, 2) # [num_rows, pool_size, 1]
+  starts_j, ends_j = tf.expand_dims(pool_starts, 1), tf.expand_dims(pool_ends, 1) # [num_rows, 1, pool_size]
+  crossing = tf.logical_or(tf.logical_and(tf.logical_and(starts_i < starts_j, starts_j <= ends_i), ends_i < ends_j),
+                           tf.logical_and(tf.logical_and(starts_j < starts_i, starts_i <= ends_j), ends_j < ends_i)) # [num_rows, pool_size, pool_size]
+  higher_ranked = tf.matrix_band_part(tf.ones([pool_size, pool_size]), -1, 0) - tf.eye(pool_size) # [pool_size, pool_size]
+  blocking = tf.to_float(crossing) * higher_ranked # [num_rows, pool_size, pool_size]
+
+  # Greedy selection in rounds: a span is rejected once a selected span blocks it, and selected once every span that
+  # could block it is rejected. Each round decides at least the best undecided span of each row.
+  def _decide(selected, rejected):
+    undecided = 1 - selected - rejected # [num_rows, pool_size]
+    blocked_by_selected = tf.squeeze(tf.matmul(blocking, tf.expand_dims(selected, 2)), 2) > 0 # [num_rows, pool_size]
+    blocked_by_undecided = tf.squeeze(tf.matmul(blocking, tf.expand_dims(undecided, 2)), 2) > 0 # [num_rows, pool_size]
+    newly_rejected = undecided * tf.to_float(blocked_by_selected)
+    newly_selected = undecided * tf.to_float(tf.logical_not(tf.logical_or(blocked_by_selected, blocked_by_undecided)))
+    return selected + newly_selected, rejected + newly_rejected
+
+  no_spans = tf.zeros_like(pool_starts, dtype=tf.float32)
+  selected, _ = tf.while_loop(lambda selected, rejected: tf.reduce_any(selected + rejected < 1), _decide, [no_spans, no_spans])
+
+  # Keep the best num_output_spans selected spans of each row, ordered by (start, end, index) or by rank.
+  kept = tf.logical_and(selected > 0, tf.cumsum(selected, 1) <= tf.to_float(tf.expand_dims(num_output_spans, 1))) # [num_rows, pool_size]
+  num_kept = tf.reduce_sum(tf.to_int32(kept), 1) # [num_rows]
+  if sort_spans:
+    num_positions = tf.to_int64(tf.maximum(max_sentence_length, tf.reduce_max(candidate_ends) + 1))
+    order_keys = (tf.to_int64(pool_starts) * num_positions + tf.to_int64(pool_ends)) * tf.to_int64(num_input_spans) + tf.to_int64(pool_indices)
+  else:
+    order_keys = tf.to_int64(tf.tile(tf.expand_dims(tf.range(pool_size), 0), [tf.shape(pool_indices)[0], 1]))
+  order_keys = tf.where(kept, order_keys, tf.fill(tf.shape(order_keys), tf.int64.max))
+  _, order = tf.nn.top_k(-order_keys, pool_size) # [num_rows, pool_size]
+  output_span_indices = util.batch_gather(pool_indices, order) # [num_rows, pool_size]
+
+  # Pad with the first selected span index (0 in rows without selected spans), also when the pool is smaller than the
+  # output.
+  output_span_indices = tf.pad(output_span_indices, [[0, 0], [0, tf.maximum(max_num_output_spans - pool_size, 0)]])[:, :max_num_output_spans]
+  padding = tf.expand_dims(tf.range(max_num_output_spans), 0) >= tf.expand_dims(num_kept, 1) # [num_rows, max_num_output_spans]
+  first_span_indices = tf.where(num_kept > 0, output_span_indices[:, 0], tf.zeros_like(num_kept)) # [num_rows]
+  first_span_indices = tf.tile(tf.expand_dims(first_span_indices, 1), [1, max_num_output_spans])
+  output_span_indices = tf.where(padding, first_span_indices, output_span_indices) # [num_rows, max_num_output_spans]
+
+  # Rows that selected fewer spans than requested while candidates were left outside the pool can differ from the
+  # kernel, which would have gone on down the ranking.
+  exhausted = tf.logical_and(num_kept < num_output_spans, pool_size < num_input_spans) # [num_rows]
+  return tf.cond(tf.reduce_any(exhausted),
+                 lambda: tf.Print(output_span_indices, [tf.where(exhausted)[:, 0], num_kept, num_output_spans],
+                                  "extract_spans_tf ran out of its candidate pool (rows, kept spans, requested spans): ",
+                                  summarize=16),
+                 lambda: output_span_indices)
+
+def load_extract_spans():
+  # The compiled kernel is used unless COREF_KERNELS=numpy, or it is missing or was built against another TensorFlow.
+  if os.environ.get("COREF_KERNELS") == "numpy":
+    return extract_spans_py_func
+  library_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coref_kernels.so")
+  try:
+    coref_op_library = tf.load_op_library(library_path)
+  except (tf.errors.OpError, OSError) as e:
+    print("Could not load {} ({}), falling back to the NumPy extract_spans.".format(library_path, e))
+    return extract_spans_py_func
+  tf.NotDifferentiable("ExtractSpans")
+  return coref_op_library.extract_spans
 
-extract_spans = coref_op_library.extract_spans
-tf.NotDifferentiable("ExtractSpans")
+extract_spans = load_extract_spans()
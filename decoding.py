@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def get_predicted_antecedents(antecedents, antecedent_scores):
+  """
+  :param antecedents: [k, c] top span indices of the antecedents of each top span.
+  :param antecedent_scores: [k, c + 1] scores of the dummy antecedent followed by each antecedent.
+  :return: [k] index of the predicted antecedent of each top span, -1 for the dummy antecedent.
+  """
+  antecedent_columns = np.argmax(antecedent_scores, axis=1) - 1 # [k]
+  gathered = antecedents[np.arange(len(antecedent_columns)), np.maximum(antecedent_columns, 0)] # [k]
+  return np.where(antecedent_columns < 0, -1, gathered)
+
+
+def find_roots(predicted_antecedents):
+  """
+  Union-find over the predicted antecedent links, compressing the paths of all spans at once by pointer jumping.
+  :return: [k] index of the first span of the cluster of each span (the span itself if it has no antecedent).
+  """
+  predicted_antecedents = np.asarray(predicted_antecedents, dtype=np.int64)
+  parents = np.where(predicted_antecedents < 0, np.arange(len(predicted_antecedents)), predicted_antecedents)
+  while True:
+    grandparents = parents[parents]
+    if (grandparents == parents).all():
+      return parents
+    parents = grandparents
+
+
+def get_cluster_ids(predicted_antecedents):
+  """
+  :return: [k] cluster of each top span (-1 if it has no antecedent and is nobody's antecedent), and the number of
+           clusters. Clusters are numbered in the order of the original per-span loop: by the first span linked to an
+           earlier span of the cluster.
+  """
+  roots = find_roots(predicted_antecedents) # [k]
+  linked = np.flatnonzero(roots != np.arange(len(roots))) # [num_linked]
+  # The first linked span of each cluster orders the clusters.
+  cluster_roots, first_linked = np.unique(roots[linked], return_index=True)
+  cluster_roots = cluster_roots[np.argsort(linked[first_linked], kind="stable")] # [num_clusters]
+
+  cluster_ids = np.full(len(roots), -1, dtype=np.int64)
+  cluster_ids[cluster_roots] = np.arange(len(cluster_roots))
+  return cluster_ids[roots], len(cluster_roots)
+
+
+def get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents):
+  """
+  Clusters in the order of get_cluster_ids, with the spans of each cluster in top span order.
+  :return: list of clusters as tuples of (start, end), and a dict from each clustered mention to its cluster.
+  """
+  cluster_ids, num_clusters = get_cluster_ids(predicted_antecedents) # [k]
+  members = np.flatnonzero(cluster_ids >= 0)
+  members = members[np.argsort(cluster_ids[members], kind="stable")] # [num_clustered]
+  cluster_ends = np.cumsum(np.bincount(cluster_ids[members], minlength=num_clusters)).tolist() # [num_clusters]
+
+  mentions = list(zip(np.asarray(top_span_starts)[members].tolist(), np.asarray(top_span_ends)[members].tolist()))
+  predicted_clusters = [tuple(mentions[start:end]) for start, end in zip([0] + cluster_ends[:-1], cluster_ends)]
+  mention_to_predicted = {m:pc for pc in predicted_clusters for m in pc}
+  return predicted_clusters, mention_to_predicted
+
+
+def get_antecedent_probabilities(antecedents, antecedent_scores):
+  """
+  Softmax over [dummy, antecedents] for every top span.
+  :return: [k] best antecedent of each top span (-1 if it has no valid antecedent) and [k] its probability.
+  """
+  antecedent_scores = np.asarray(antecedent_scores, dtype=np.float64)
+  probabilities = np.exp(antecedent_scores - antecedent_scores.max(axis=1, keepdims=True)) # [k, c + 1]
+  probabilities /= probabilities.sum(axis=1, keepdims=True)
+  best_columns = np.argmax(antecedent_scores[:, 1:], axis=1) # [k]
+  rows = np.arange(len(best_columns))
+  valid = np.isfinite(antecedent_scores[rows, best_columns + 1]) # [k]
+  best_antecedents = np.where(valid, antecedents[rows, best_columns], -1)
+  best_probabilities = np.where(valid, probabilities[rows, best_columns + 1], 0.0)
+  return best_antecedents, best_probabilities
+
+
+def get_thresholded_antecedents(best_antecedents, best_probabilities, threshold):
+  # Links each top span to its best antecedent if the probability of that link is at least the threshold.
+  return np.where(np.logical_and(best_antecedents >= 0, best_probabilities >= threshold), best_antecedents, -1)
+
+
+def get_cluster_confidences(predicted_antecedents, link_probabilities):
+  """
+  Confidence of each cluster (in the order of get_cluster_ids) as the probability of its weakest antecedent link: the
+  highest threshold of get_thresholded_antecedents at which the cluster does not break apart. Lower thresholds keep
+  all of its links but can merge other spans into it, so it is not guaranteed to stay identical.
+  """
+  predicted_antecedents = np.asarray(predicted_antecedents)
+  cluster_ids, num_clusters = get_cluster_ids(predicted_antecedents)
+  linked = predicted_antecedents >= 0
+  confidences = np.ones(num_clusters)
+  np.minimum.at(confidences, cluster_ids[linked], np.asarray(link_probabilities)[linked])
+  return confidences
+
+
+def get_mention_antecedents(top_span_starts, top_span_ends, best_antecedents, best_probabilities):
+  # [mention start, mention end, antecedent start, antecedent end, probability] for each top span with an antecedent.
+  mentions = np.flatnonzero(best_antecedents >= 0)
+  antecedents = best_antecedents[mentions]
+  return [[s, e, a_s, a_e, p] for s, e, a_s, a_e, p in zip(
+    top_span_starts[mentions].tolist(), top_span_ends[mentions].tolist(),
+    top_span_starts[antecedents].tolist(), top_span_ends[antecedents].tolist(), best_probabilities[mentions].tolist())]
+
+
+def clusters_at_threshold(mention_antecedents, threshold):
+  """
+  Clusters from the output of get_mention_antecedents, without running the model again. Top spans are sorted by (start,
+  end), so the clusters match those decoded from the model outputs with get_thresholded_antecedents.
+  """
+  if len(mention_antecedents) == 0:
+    return []
+  mention_antecedents = np.array(mention_antecedents, dtype=np.float64)
+  spans, span_indices = np.unique(mention_antecedents[:, :4].reshape([-1, 2]).astype(np.int64), axis=0, return_inverse=True)
+  span_indices = span_indices.reshape([-1, 2])
+  best_antecedents = np.full(len(spans), -1, dtype=np.int64)
+  best_probabilities = np.zeros(len(spans))
+  best_antecedents[span_indices[:, 0]] = span_indices[:, 1]
+  best_probabilities[span_indices[:, 0]] = mention_antecedents[:, 4]
+  predicted_antecedents = get_thresholded_antecedents(best_antecedents, best_probabilities, threshold)
+  return get_predicted_clusters(spans[:, 0], spans[:, 1], predicted_antecedents)[0]
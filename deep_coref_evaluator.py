@@ -1,6 +1,7 @@
 import numpy as np
 from collections import Counter
-from sklearn.utils.linear_assignment_ import linear_assignment
+
+import metrics
 
 
 def f1(p_num, p_den, r_num, r_den, beta=1):
@@ -94,14 +95,7 @@ def phi4(c1, c2):
 
 
 def ceafe(clusters, gold_clusters):
-    clusters = [c for c in clusters if len(c) != 1]
-    scores = np.zeros((len(gold_clusters), len(clusters)))
-    for i in range(len(gold_clusters)):
-        for j in range(len(clusters)):
-            scores[i, j] = phi4(gold_clusters[i], clusters[j])
-    matching = linear_assignment(-scores)
-    similarity = sum(scores[matching[:, 0], matching[:, 1]])
-    return similarity, len(clusters), similarity, len(gold_clusters)
+    return metrics.ceafe(clusters, gold_clusters)
 
 
 def lea(clusters, mention_to_gold):
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import json
+
+import numpy as np
+import tensorflow as tf
+import coref_model_sentence_span as cm
+import util
+
+def teacher_antecedents(top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores):
+  # Lists the (mention start, mention end, antecedent start, antecedent end, score) of every valid antecedent pair kept
+  # by the teacher. The dummy antecedent always scores 0, so it is left implicit.
+  pairs = []
+  for i, (antecedents, scores) in enumerate(zip(top_antecedents, top_antecedent_scores[:, 1:])):
+    for antecedent, score in zip(antecedents, scores):
+      if antecedent < i and np.isfinite(score):
+        pairs.append([int(top_span_starts[i]), int(top_span_ends[i]),
+                      int(top_span_starts[antecedent]), int(top_span_ends[antecedent]), round(float(score), 4)])
+  return pairs
+
+if __name__ == "__main__":
+  # Usage: python distill.py <teacher experiment> <input.jsonlines> <output.jsonlines>
+  # Adds the antecedent scores of the teacher to each document, for training a student configuration with
+  # distillation_weight > 0 on the output file.
+  config = util.initialize_from_env()
+  input_filename = sys.argv[2]
+  output_filename = sys.argv[3]
+
+  model = cm.CorefModel(config)
+
+  with tf.Session() as session:
+    model.restore(session)
+
+    with open(output_filename, "w") as output_file:
+      with open(input_filename) as input_file:
+        for example_num, line in enumerate(input_file.readlines()):
+          example = json.loads(line)
+          tensorized_example = model.tensorize_example(example, is_training=False)
+          feed_dict = {i:t for i,t in zip(model.input_tensors, tensorized_example)}
+          _, _, _, top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores = session.run(model.predictions, feed_dict=feed_dict)
+          example["teacher_antecedents"] = teacher_antecedents(top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores)
+
+          output_file.write(json.dumps(example))
+          output_file.write("\n")
+          if example_num % 100 == 0:
+            print("Distilled {} examples.".format(example_num + 1))
@@ -0,0 +1,94 @@
+#ifndef COREF_EXTRACT_SPANS_H_
+#define COREF_EXTRACT_SPANS_H_
+
+#include <algorithm>
+#include <climits>
+#include <cstdint>
+#include <numeric>
+#include <vector>
+
+// Span selection of the ExtractSpans op, without TensorFlow dependencies so that it can be benchmarked standalone.
+
+namespace coref {
+
+// Buffers reused across rows, so that extracting spans does not allocate for every row.
+struct ExtractSpansScratch {
+  std::vector<int> candidates;
+  std::vector<int> selected_spans;
+  std::vector<int> start_to_latest_end;
+  std::vector<int> end_to_earliest_start;
+};
+
+// Greedily selects up to num_output_spans spans in decreasing order of score (ties broken by lower index), skipping
+// spans that cross an already selected span. Writes output_size indices: the selected spans, sorted by (start, end,
+// index) if sort_spans and in selection order otherwise, padded with the first of them.
+inline void ExtractSpans(const float* span_scores, const int32_t* candidate_starts, const int32_t* candidate_ends,
+                         int num_input_spans, int num_output_spans, int max_sentence_length, bool sort_spans,
+                         int32_t* output_span_indices, int output_size, ExtractSpansScratch* scratch) {
+  // Selected spans are recorded in flat arrays indexed by token position, so the crossing check of a candidate is
+  // O(width) array reads. Candidates ending beyond max_sentence_length only make the arrays larger.
+  int num_positions = max_sentence_length;
+  for (int i = 0; i < num_input_spans; ++i) {
+    num_positions = std::max(num_positions, candidate_ends[i] + 1);
+  }
+  std::vector<int>& start_to_latest_end = scratch->start_to_latest_end;
+  std::vector<int>& end_to_earliest_start = scratch->end_to_earliest_start;
+  start_to_latest_end.assign(num_positions, -1);
+  end_to_earliest_start.assign(num_positions, INT_MAX);
+
+  // Candidates are popped from a heap, so only the candidates examined before enough spans are selected get ordered.
+  auto lower_priority = [span_scores](int i1, int i2) {
+    return span_scores[i1] < span_scores[i2] || (span_scores[i1] == span_scores[i2] && i1 > i2);
+  };
+  std::vector<int>& candidates = scratch->candidates;
+  candidates.resize(num_input_spans);
+  std::iota(candidates.begin(), candidates.end(), 0);
+  std::make_heap(candidates.begin(), candidates.end(), lower_priority);
+
+  std::vector<int>& selected_spans = scratch->selected_spans;
+  selected_spans.clear();
+  auto heap_end = candidates.end();
+  while (static_cast<int>(selected_spans.size()) < num_output_spans && heap_end != candidates.begin()) {
+    std::pop_heap(candidates.begin(), heap_end, lower_priority);
+    --heap_end;
+    const int i = *heap_end;
+    const int start = candidate_starts[i];
+    const int end = candidate_ends[i];
+    bool any_crossing = false;
+    for (int j = start + 1; j <= end && !any_crossing; ++j) {
+      // Given (), exists [], such that ( [ ) ]
+      any_crossing = start_to_latest_end[j] > end;
+    }
+    for (int j = start; j < end && !any_crossing; ++j) {
+      // Given (), exists [], such that [ ( ] )
+      any_crossing = end_to_earliest_start[j] < start;
+    }
+    if (!any_crossing) {
+      selected_spans.push_back(i);
+      start_to_latest_end[start] = std::max(start_to_latest_end[start], end);
+      end_to_earliest_start[end] = std::min(end_to_earliest_start[end], start);
+    }
+  }
+
+  if (sort_spans) {
+    std::sort(selected_spans.begin(), selected_spans.end(),
+              [candidate_starts, candidate_ends](int i1, int i2) {
+                if (candidate_starts[i1] != candidate_starts[i2]) {
+                  return candidate_starts[i1] < candidate_starts[i2];
+                } else if (candidate_ends[i1] != candidate_ends[i2]) {
+                  return candidate_ends[i1] < candidate_ends[i2];
+                } else {
+                  return i1 < i2;
+                }
+              });
+  }
+  const int num_selected_spans = selected_spans.size();
+  for (int i = 0; i < output_size; ++i) {
+    // Pad with the first span index.
+    output_span_indices[i] = i < num_selected_spans ? selected_spans[i] : (num_selected_spans > 0 ? selected_spans[0] : 0);
+  }
+}
+
+}  // namespace coref
+
+#endif  // COREF_EXTRACT_SPANS_H_
@@ -0,0 +1,176 @@
+// Compares the span selection of the ExtractSpans op with its previous implementation (full sort and hash maps) on
+// candidates shaped like those of CorefModel: every span of up to max_span_width words inside a sentence.
+//
+// Also measures a batch of documents split over threads with one scratch per thread, as the op shards its rows.
+//
+//   g++ -std=c++11 -O2 -pthread extract_spans_benchmark.cc -o extract_spans_benchmark
+//   ./extract_spans_benchmark [num_words ...]
+
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+#include <thread>
+#include <unordered_map>
+#include <vector>
+
+#include "extract_spans.h"
+
+// Previous implementation of ExtractSpansOp::Compute for a single row.
+void LegacyExtractSpans(const float* span_scores, const int32_t* candidate_starts, const int32_t* candidate_ends,
+                        int num_input_spans, int num_output_spans, int32_t* output_span_indices) {
+  std::vector<int> sorted_input_span_indices(num_input_spans);
+  std::iota(sorted_input_span_indices.begin(), sorted_input_span_indices.end(), 0);
+  std::sort(sorted_input_span_indices.begin(), sorted_input_span_indices.end(),
+            [span_scores](int j1, int j2) {
+              return span_scores[j2] < span_scores[j1];
+            });
+
+  std::vector<int> top_span_indices;
+  std::unordered_map<int, int> end_to_earliest_start;
+  std::unordered_map<int, int> start_to_latest_end;
+  int current_span_index = 0,
+      num_selected_spans = 0;
+  while (num_selected_spans < num_output_spans && current_span_index < num_input_spans) {
+    int i = sorted_input_span_indices[current_span_index];
+    bool any_crossing = false;
+    const int start = candidate_starts[i];
+    const int end = candidate_ends[i];
+    for (int j = start; j <= end; ++j) {
+      auto latest_end_iter = start_to_latest_end.find(j);
+      if (latest_end_iter != start_to_latest_end.end() && j > start && latest_end_iter->second > end) {
+        any_crossing = true;
+        break;
+      }
+      auto earliest_start_iter = end_to_earliest_start.find(j);
+      if (earliest_start_iter != end_to_earliest_start.end() && j < end && earliest_start_iter->second < start) {
+        any_crossing = true;
+        break;
+      }
+    }
+    if (!any_crossing) {
+      top_span_indices.push_back(i);
+      ++num_selected_spans;
+      auto latest_end_iter = start_to_latest_end.find(start);
+      if (latest_end_iter == start_to_latest_end.end() || end > latest_end_iter->second) {
+        start_to_latest_end[start] = end;
+      }
+      auto earliest_start_iter = end_to_earliest_start.find(end);
+      if (earliest_start_iter == end_to_earliest_start.end() || start < earliest_start_iter->second) {
+        end_to_earliest_start[end] = start;
+      }
+    }
+    ++current_span_index;
+  }
+  std::sort(top_span_indices.begin(), top_span_indices.end(),
+            [candidate_starts, candidate_ends] (int i1, int i2) {
+              if (candidate_starts[i1] < candidate_starts[i2]) {
+                return true;
+              } else if (candidate_starts[i1] > candidate_starts[i2]) {
+                return false;
+              } else if (candidate_ends[i1] < candidate_ends[i2]) {
+                return true;
+              } else if (candidate_ends[i1] > candidate_ends[i2]) {
+                return false;
+              } else {
+                return i1 < i2;
+              }
+            });
+  for (int i = 0; i < num_output_spans; ++i) {
+    output_span_indices[i] = top_span_indices[i];
+  }
+}
+
+template <typename F>
+double MillisecondsPerCall(F f, int num_runs) {
+  auto start_time = std::chrono::steady_clock::now();
+  for (int i = 0; i < num_runs; ++i) {
+    f();
+  }
+  std::chrono::duration<double, std::milli> elapsed = std::chrono::steady_clock::now() - start_time;
+  return elapsed.count() / num_runs;
+}
+
+int main(int argc, char** argv) {
+  std::vector<int> document_lengths;
+  for (int i = 1; i < argc; ++i) {
+    document_lengths.push_back(std::atoi(argv[i]));
+  }
+  if (document_lengths.empty()) {
+    document_lengths = {500, 2000, 10000};
+  }
+  const int max_span_width = 30;
+  const int sentence_length = 25;
+  const double top_span_ratio = 0.4;
+  const int num_runs = 20;
+  std::mt19937 generator(0);
+  std::normal_distribution<float> score_distribution;
+
+  std::printf("%10s %12s %12s %12s %10s %8s\n", "words", "candidates", "legacy (ms)", "new (ms)", "speedup", "same");
+  std::vector<float> batch_scores;
+  std::vector<int32_t> batch_starts, batch_ends;
+  for (int num_words : document_lengths) {
+    std::vector<int32_t> starts, ends;
+    for (int start = 0; start < num_words; ++start) {
+      const int sentence_end = std::min((start / sentence_length + 1) * sentence_length, num_words);
+      for (int end = start; end < std::min(start + max_span_width, sentence_end); ++end) {
+        starts.push_back(start);
+        ends.push_back(end);
+      }
+    }
+    const int num_candidates = starts.size();
+    std::vector<float> scores(num_candidates);
+    for (float& score : scores) {
+      score = score_distribution(generator);
+    }
+    const int k = static_cast<int>(num_words * top_span_ratio);
+
+    std::vector<int32_t> legacy_output(k), new_output(k);
+    coref::ExtractSpansScratch scratch;
+    const double legacy_ms = MillisecondsPerCall([&]() {
+      LegacyExtractSpans(scores.data(), starts.data(), ends.data(), num_candidates, k, legacy_output.data());
+    }, num_runs);
+    const double new_ms = MillisecondsPerCall([&]() {
+      coref::ExtractSpans(scores.data(), starts.data(), ends.data(), num_candidates, k, num_words, true,
+                          new_output.data(), k, &scratch);
+    }, num_runs);
+    std::printf("%10d %12d %12.3f %12.3f %9.2fx %8s\n", num_words, num_candidates, legacy_ms, new_ms,
+                legacy_ms / new_ms, legacy_output == new_output ? "yes" : "NO");
+    if (num_words == document_lengths.back()) {
+      batch_scores = scores;
+      batch_starts = starts;
+      batch_ends = ends;
+    }
+  }
+
+  // A batch of rows with the candidates of the last document length.
+  const int batch_size = 32;
+  const int num_words = document_lengths.back();
+  const int num_candidates = batch_scores.size();
+  const int k = static_cast<int>(num_words * top_span_ratio);
+  std::vector<int32_t> batch_output(batch_size * k);
+  std::printf("\n%10s %12s %12s\n", "threads", "batch (ms)", "speedup");
+  double single_thread_ms = 0;
+  for (int num_threads = 1; num_threads <= static_cast<int>(std::thread::hardware_concurrency()) && num_threads <= batch_size; num_threads *= 2) {
+    const double batch_ms = MillisecondsPerCall([&]() {
+      std::vector<std::thread> threads;
+      for (int t = 0; t < num_threads; ++t) {
+        threads.emplace_back([&, t]() {
+          coref::ExtractSpansScratch scratch;
+          for (int row = t * batch_size / num_threads; row < (t + 1) * batch_size / num_threads; ++row) {
+            coref::ExtractSpans(batch_scores.data(), batch_starts.data(), batch_ends.data(), num_candidates, k,
+                                num_words, true, batch_output.data() + row * k, k, &scratch);
+          }
+        });
+      }
+      for (std::thread& thread : threads) {
+        thread.join();
+      }
+    }, 5);
+    if (num_threads == 1) {
+      single_thread_ms = batch_ms;
+    }
+    std::printf("%10d %12.3f %11.2fx\n", num_threads, batch_ms, single_thread_ms / batch_ms);
+  }
+  return 0;
+}
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+import numpy as np
+
+
+class StaticFeatureCache(object):
+  """
+  Inference-time LRU cache of the features of a word that do not depend on its context: the context GloVe embedding,
+  the head embedding and the char CNN encoding, stored concatenated. Words already seen in earlier documents skip both
+  the embedding dictionary lookups and the char CNN.
+  """
+  def __init__(self, model, max_size):
+    self.model = model
+    self.max_size = max_size
+    self.use_chars = model.config["char_embedding_size"] > 0
+    self.max_padding = max(model.config["filter_widths"])
+    self.context_size = model.context_embeddings.size
+    self.head_size = model.head_embeddings.size
+    self.entries = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def key(self, word, max_word_length):
+    # The char CNN also max-pools over the <unk> padding after a word, so its encoding depends on the amount of padding,
+    # but only until every filter has a window entirely inside the padding.
+    if not self.use_chars:
+      return word
+    return word, min(max_word_length - len(word), self.max_padding)
+
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups > 0 else 0.0
+
+  def word(self, key):
+    return key[0] if self.use_chars else key
+
+  def compute_features(self, session, keys):
+    context_emb = np.array([self.model.context_embeddings[self.word(k)] for k in keys]).reshape([len(keys), self.context_size])
+    head_emb = np.array([self.model.head_embeddings[self.word(k)] for k in keys]).reshape([len(keys), self.head_size])
+    features = [context_emb, head_emb]
+    if self.use_chars:
+      char_emb = [None] * len(keys)
+      padded_lengths = {}
+      for i, (word, padding) in enumerate(keys):
+        padded_length = len(word) + padding if padding < self.max_padding else None # None: any length with enough padding.
+        padded_lengths.setdefault(padded_length, []).append(i)
+      for padded_length, indices in padded_lengths.items():
+        if padded_length is None:
+          padded_length = max(len(keys[i][0]) for i in indices) + self.max_padding
+        word_char_index = np.zeros([len(indices), padded_length])
+        for row, i in enumerate(indices):
+          word = keys[i][0]
+          word_char_index[row, :len(word)] = [self.model.char_dict[c] for c in word]
+        word_char_emb = session.run(self.model.word_char_emb, feed_dict={self.model.word_char_index: word_char_index})
+        for row, i in enumerate(indices):
+          char_emb[i] = word_char_emb[row]
+      features.append(np.array(char_emb))
+    return np.concatenate(features, 1).astype(np.float32) # [num_keys, emb]
+
+  def fill_feed_dict(self, session, tensorized_example, feed_dict):
+    """
+    Feeds the cached features of a tensorized example, which can be built with lookup_embeddings=False since its
+    context and head embeddings are replaced here.
+    """
+    tokens, char_index, text_len = tensorized_example[0], tensorized_example[4], tensorized_example[5]
+    max_word_length = char_index.shape[2]
+    token_keys = [[self.key(w, max_word_length) for w in sentence] for sentence in tokens]
+
+    document_features = {}
+    missing_keys = []
+    for k in set(k for sentence_keys in token_keys for k in sentence_keys):
+      if k in self.entries:
+        self.entries[k] = self.entries.pop(k) # Most recently used.
+        document_features[k] = self.entries[k]
+      else:
+        missing_keys.append(k)
+    num_tokens = sum(text_len)
+    num_missing = sum(1 for i, l in enumerate(text_len) for k in token_keys[i][:l] if k not in document_features)
+    self.hits += num_tokens - num_missing
+    self.misses += num_missing
+
+    if missing_keys:
+      document_features.update(zip(missing_keys, self.compute_features(session, missing_keys)))
+      for k in missing_keys:
+        self.entries[k] = document_features[k]
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+    features = np.array([[document_features[k] for k in sentence_keys] for sentence_keys in token_keys]) # [num_sentences, max_sentence_length, emb]
+    # Padding slots have no embeddings, as in CorefModel.tensorize_example.
+    padding_mask = np.arange(features.shape[1])[None, :] >= np.array(text_len)[:, None] # [num_sentences, max_sentence_length]
+    context_word_emb = features[:, :, :self.context_size]
+    head_word_emb = features[:, :, self.context_size:self.context_size + self.head_size]
+    context_word_emb[padding_mask] = 0
+    head_word_emb[padding_mask] = 0
+    feed_dict[self.model.input_tensors[1]] = context_word_emb
+    feed_dict[self.model.input_tensors[2]] = head_word_emb
+    if self.use_chars:
+      feed_dict[self.model.aggregated_char_emb] = features[:, :, self.context_size + self.head_size:]
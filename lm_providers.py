@@ -0,0 +1,161 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import h5py
+import numpy as np
+import tensorflow as tf
+
+import util
+
+DEFAULT_ELMO_MODULE = "https://tfhub.dev/google/elmo/2"
+
+
+class LMProvider(object):
+  """
+  Source of the contextualized LM features of a document, with shape [num_sentences, max_sentence_length, lm_size,
+  lm_layers]. Features computed on the host are fed through the LM embeddings input of the model, features computed in
+  the graph replace it.
+  """
+  def __init__(self, lm_size, lm_layers):
+    self.lm_size = lm_size
+    self.lm_layers = lm_layers
+
+  def load_lm_embeddings(self, doc_key, sentence_offset=0, num_sentences=None):
+    # Host-side features of the given sentences of a document, fed as the LM embeddings input.
+    return np.zeros([0, 0, self.lm_size, self.lm_layers], dtype=np.float32)
+
+  def get_lm_emb(self, lm_emb, tokens, text_len, context_word_emb):
+    # Graph-side features, given the fed LM embeddings and the other inputs of the model.
+    raise NotImplementedError()
+
+
+class HDF5LMProvider(LMProvider):
+  """
+  Features cached by cache_elmo.py. Each document is a single [num_words, lm_size, lm_layers] dataset (float16 or
+  float32) with the length of its sentences in the "sentence_lengths" attribute, so a range of sentences is one
+  contiguous read. Caches with one group per document and one dataset per sentence are still supported.
+  """
+  def __init__(self, lm_size, lm_layers, path, mmap=False):
+    super(HDF5LMProvider, self).__init__(lm_size, lm_layers)
+    self.path = path
+    self.mmap = mmap
+    self.lm_file = h5py.File(path, "r")
+
+  def load_lm_embeddings(self, doc_key, sentence_offset=0, num_sentences=None):
+    file_key = doc_key.replace("/", ":")
+    doc = self.lm_file[file_key]
+    if isinstance(doc, h5py.Group):
+      return self.load_sentence_datasets(doc, sentence_offset, num_sentences)
+
+    doc_sentence_lengths = doc.attrs["sentence_lengths"]
+    if num_sentences is None:
+      num_sentences = len(doc_sentence_lengths) - sentence_offset
+    sentence_lengths = doc_sentence_lengths[sentence_offset:sentence_offset + num_sentences]
+    word_start = int(doc_sentence_lengths[:sentence_offset].sum())
+    word_end = word_start + int(sentence_lengths.sum())
+    words_emb = self.read_words(doc, word_start, word_end) # [num_words, lm_size, lm_layers]
+
+    # Padding is done once, in float32, by scattering the words into their (sentence, position) slots.
+    lm_emb = np.zeros([num_sentences, sentence_lengths.max(), self.lm_size, self.lm_layers], dtype=np.float32)
+    lm_emb[np.arange(sentence_lengths.max()) < sentence_lengths[:, None]] = words_emb
+    return lm_emb
+
+  def read_words(self, dataset, word_start, word_end):
+    # Contiguous datasets can be memory-mapped, which only pages in the rows that are used.
+    offset = dataset.id.get_offset() if self.mmap else None
+    if offset is None: # Chunked or compressed datasets are read through HDF5.
+      return dataset[word_start:word_end]
+    # The dataset can live in another file than self.path through an external link (see cache_elmo.py).
+    words_emb = np.memmap(dataset.file.filename, mode="r", dtype=dataset.dtype, offset=offset, shape=dataset.shape)
+    return words_emb[word_start:word_end]
+
+  def load_sentence_datasets(self, group, sentence_offset, num_sentences):
+    if num_sentences is None:
+      num_sentences = len(list(group.keys())) - sentence_offset
+    sentences = [group[str(i)][...] for i in range(sentence_offset, sentence_offset + num_sentences)]
+    lm_emb = np.zeros([num_sentences, max(s.shape[0] for s in sentences), self.lm_size, self.lm_layers], dtype=np.float32)
+    for i, s in enumerate(sentences):
+      lm_emb[i, :s.shape[0], :, :] = s
+    return lm_emb
+
+  def get_lm_emb(self, lm_emb, tokens, text_len, context_word_emb):
+    return lm_emb
+
+
+def elmo_lm_emb(module_path, tokens, text_len):
+  # TF-Hub is only needed by this provider, so it is not required to run from cached features.
+  import tensorflow_hub as hub
+  elmo_module = hub.Module(module_path)
+  lm_embeddings = elmo_module(
+      inputs={"tokens": tokens, "sequence_len": text_len},
+      signature="tokens", as_dict=True)
+  word_emb = lm_embeddings["word_emb"]  # [num_sentences, max_sentence_length, 512]
+  return tf.stack([tf.concat([word_emb, word_emb], -1),
+                   lm_embeddings["lstm_outputs1"],
+                   lm_embeddings["lstm_outputs2"]], -1)  # [num_sentences, max_sentence_length, 1024, 3]
+
+
+class ModuleLMProvider(LMProvider):
+  """
+  ELMo run in the graph from a TF-Hub module. module_path can be the TF-Hub URL or a local copy of the module (e.g. the
+  extracted archive of the URL), which needs no network access.
+  """
+  def __init__(self, lm_size, lm_layers, module_path):
+    super(ModuleLMProvider, self).__init__(lm_size, lm_layers)
+    self.module_path = module_path
+
+  def get_lm_emb(self, lm_emb, tokens, text_len, context_word_emb):
+    return elmo_lm_emb(self.module_path, tokens, text_len)
+
+
+class ZeroLMProvider(LMProvider):
+  """
+  No LM features. Keeps the input size of a model trained with ELMo, at a loss of accuracy.
+  """
+  def get_lm_emb(self, lm_emb, tokens, text_len, context_word_emb):
+    num_sentences = tf.shape(tokens)[0]
+    max_sentence_length = tf.shape(tokens)[1]
+    return tf.zeros([num_sentences, max_sentence_length, self.lm_size, self.lm_layers])
+
+
+class NullLMProvider(LMProvider):
+  """
+  Provider of models without LM features (use_lm = false). It only feeds the empty LM embeddings of LMProvider, which
+  the model ignores.
+  """
+  def get_lm_emb(self, lm_emb, tokens, text_len, context_word_emb):
+    raise ValueError("The model has no LM features (use_lm = false).")
+
+
+class ProjectionLMProvider(LMProvider):
+  """
+  Learned projection of the context word embeddings in place of the LM features. It has its own variables, so it is
+  trained with the model (e.g. as a distillation student) rather than swapped into an ELMo checkpoint.
+  """
+  def get_lm_emb(self, lm_emb, tokens, text_len, context_word_emb):
+    with tf.variable_scope("lm_projection"):
+      projected_emb = util.projection(context_word_emb, self.lm_size * self.lm_layers) # [num_sentences, max_sentence_length, lm_size * lm_layers]
+    num_sentences = tf.shape(tokens)[0]
+    max_sentence_length = tf.shape(tokens)[1]
+    return tf.reshape(projected_emb, [num_sentences, max_sentence_length, self.lm_size, self.lm_layers])
+
+
+def get_lm_provider(config):
+  lm_size = config["lm_size"]
+  lm_layers = config["lm_layers"]
+  if not config["use_lm"]:
+    return NullLMProvider(lm_size, lm_layers)
+  provider = config["lm_provider"]
+  if provider == "auto":
+    provider = "hdf5" if config["lm_path"] else "module"
+  if provider == "hdf5":
+    return HDF5LMProvider(lm_size, lm_layers, config["lm_path"], config["lm_mmap"])
+  elif provider == "module":
+    return ModuleLMProvider(lm_size, lm_layers, config["lm_module_path"])
+  elif provider == "zeros":
+    return ZeroLMProvider(lm_size, lm_layers)
+  elif provider == "projection":
+    return ProjectionLMProvider(lm_size, lm_layers)
+  else:
+    raise ValueError("Unknown LM provider: {}".format(provider))
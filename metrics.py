@@ -3,8 +3,10 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
 from collections import Counter
-from sklearn.utils.linear_assignment_ import linear_assignment
+from scipy.optimize import linear_sum_assignment
 
 
 def f1(p_num, p_den, r_num, r_den, beta=1):
@@ -138,14 +140,50 @@ def phi4(c1, c2):
     return 2 * len([m for m in c1 if m in c2]) / float(len(c1) + len(c2))
 
 
+def aligned_similarity(gold, predicted, similarities, num_gold, num_predicted):
+    """
+    Total similarity of the best one-to-one alignment of gold and predicted clusters, given the similarities of their
+    overlapping pairs (all other pairs have similarity 0). Clusters only compete within connected components of the
+    overlap graph, so each component is aligned on its own and components with a single cluster on one side just take
+    their best pair.
+    """
+    if len(similarities) == 0:
+        return 0.0
+    overlap_graph = scipy.sparse.coo_matrix((np.ones(len(similarities)), (gold, num_gold + predicted)),
+                                            shape=(num_gold + num_predicted, num_gold + num_predicted))
+    num_components, components = scipy.sparse.csgraph.connected_components(overlap_graph, directed=False)
+    pair_components = components[gold]
+    num_gold_clusters = np.bincount(components[np.unique(gold)], minlength=num_components)
+    num_predicted_clusters = np.bincount(components[num_gold + np.unique(predicted)], minlength=num_components)
+    single = np.logical_or(num_gold_clusters <= 1, num_predicted_clusters <= 1)
+
+    best_pairs = np.zeros(num_components)
+    np.maximum.at(best_pairs, pair_components, similarities)
+    similarity = best_pairs[single].sum()
+
+    pairs_by_component = np.argsort(pair_components, kind="stable")
+    component_ends = np.cumsum(np.bincount(pair_components, minlength=num_components))
+    component_starts = component_ends - np.bincount(pair_components, minlength=num_components)
+    for component in np.flatnonzero(np.logical_not(single)):
+        pairs = pairs_by_component[component_starts[component]:component_ends[component]]
+        _, rows = np.unique(gold[pairs], return_inverse=True)
+        _, columns = np.unique(predicted[pairs], return_inverse=True)
+        scores = np.zeros((rows.max() + 1, columns.max() + 1))
+        scores[rows, columns] = similarities[pairs]
+        matched_rows, matched_columns = linear_sum_assignment(scores, maximize=True)
+        similarity += scores[matched_rows, matched_columns].sum()
+    return similarity
+
+
 def ceafe(clusters, gold_clusters):
     clusters = [c for c in clusters if len(c) != 1]
-    scores = np.zeros((len(gold_clusters), len(clusters)))
-    for i in range(len(gold_clusters)):
-        for j in range(len(clusters)):
-            scores[i, j] = phi4(gold_clusters[i], clusters[j])
-    matching = linear_assignment(-scores)
-    similarity = sum(scores[matching[:, 0], matching[:, 1]])
+    mention_to_gold = {m:i for i, gc in enumerate(gold_clusters) for m in gc}
+    overlaps = Counter((mention_to_gold[m], j) for j, c in enumerate(clusters) for m in c if m in mention_to_gold)
+    gold = np.array([i for i, _ in overlaps], dtype=np.int64)
+    predicted = np.array([j for _, j in overlaps], dtype=np.int64)
+    # phi4 of each overlapping pair.
+    similarities = np.array([2 * count / float(len(gold_clusters[i]) + len(clusters[j])) for (i, j), count in overlaps.items()])
+    similarity = aligned_similarity(gold, predicted, similarities, len(gold_clusters), len(clusters))
     return similarity, len(clusters), similarity, len(gold_clusters)
 
 
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import resource
+import sys
+import time
+
+import util
+import window_evaluate
+
+def evaluate_dtype(args):
+  # Runs in a fresh process, so the peak resident memory only accounts for this dtype.
+  config, dtype = args
+  start_time = time.time()
+  f1 = window_evaluate.evaluate_with_overrides(config, { "inference_dtype": dtype })
+  seconds = time.time() - start_time
+  max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  return f1, seconds, max_rss_mb
+
+if __name__ == "__main__":
+  # Usage: python precision_evaluate.py <experiment> [<max F1 drop in points>]
+  # Evaluates the checkpoint with float32, float16 and bfloat16 scoring and fails if a reduced precision loses more
+  # than the allowed F1 (0.1 points by default). Timings include loading the eval data.
+  config = util.initialize_from_env()
+  max_f1_drop = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+
+  results = []
+  for dtype in ["float32", "float16", "bfloat16"]:
+    pool = multiprocessing.Pool(1)
+    results.append((dtype,) + pool.apply(evaluate_dtype, [(config, dtype)]))
+    pool.close()
+  baseline_f1, baseline_seconds = results[0][1], results[0][2]
+
+  print("{:>10} {:>10} {:>10} {:>10} {:>12}".format("dtype", "F1", "delta", "speedup", "max RSS (MB)"))
+  regressions = []
+  for dtype, f1, seconds, max_rss_mb in results:
+    delta = (f1 - baseline_f1) * 100
+    print("{:>10} {:>10.2f} {:>+10.2f} {:>9.2f}x {:>12.0f}".format(dtype, f1 * 100, delta, baseline_seconds / seconds, max_rss_mb))
+    if -delta > max_f1_drop:
+      regressions.append(dtype)
+  if regressions:
+    print("F1 dropped by more than {} points with {}.".format(max_f1_drop, ", ".join(regressions)))
+    sys.exit(1)
@@ -7,6 +7,9 @@ import json
 
 import tensorflow as tf
 import coref_model_sentence_span as cm
+import decoding
+import feature_cache
+import sliding_window
 import util
 
 if __name__ == "__main__":
@@ -22,18 +25,35 @@ if __name__ == "__main__":
 
   with tf.Session() as session:
     model.restore(session)
+    static_features = feature_cache.StaticFeatureCache(model, config["feature_cache_size"]) if config["feature_cache_size"] > 0 else None
 
     with open(output_filename, "w") as output_file:
       with open(input_filename) as input_file:
         for example_num, line in enumerate(input_file.readlines()):
           example = json.loads(line)
-          tensorized_example = model.tensorize_example(example, is_training=False)
-          feed_dict = {i:t for i,t in zip(model.input_tensors, tensorized_example)}
-          _, _, _, top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores = session.run(model.predictions, feed_dict=feed_dict)
-          predicted_antecedents = model.get_predicted_antecedents(top_antecedents, top_antecedent_scores)
-          example["predicted_clusters"], _ = model.get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
+          if config["inference_window_sentences"] > 0:
+            example["predicted_clusters"] = sliding_window.predict_clusters(model, session, example,
+                                                                            config["inference_window_sentences"],
+                                                                            config["inference_window_overlap"],
+                                                                            config["inference_threads"])
+          else:
+            tensorized_example = model.tensorize_example(example, is_training=False, lookup_embeddings=static_features is None)
+            feed_dict = {i:t for i,t in zip(model.input_tensors, tensorized_example)}
+            if static_features is not None:
+              static_features.fill_feed_dict(session, tensorized_example, feed_dict)
+            if config["output_antecedent_probabilities"]:
+              _, _, _, top_span_starts, top_span_ends, top_antecedents, top_antecedent_scores = session.run(model.predictions, feed_dict=feed_dict)
+              predicted_antecedents = model.get_predicted_antecedents(top_antecedents, top_antecedent_scores)
+              best_antecedents, best_probabilities = decoding.get_antecedent_probabilities(top_antecedents, top_antecedent_scores)
+              example["antecedent_probabilities"] = decoding.get_mention_antecedents(top_span_starts, top_span_ends, best_antecedents, best_probabilities)
+              example["cluster_confidences"] = decoding.get_cluster_confidences(predicted_antecedents, best_probabilities).tolist()
+            else:
+              top_span_starts, top_span_ends, predicted_antecedents = session.run(model.top_span_predictions, feed_dict=feed_dict)
+            example["predicted_clusters"], _ = model.get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
 
           output_file.write(json.dumps(example))
           output_file.write("\n")
           if example_num % 100 == 0:
             print("Decoded {} examples.".format(example_num + 1))
+            if static_features is not None:
+              print("Feature cache: {} words, {:.2f}% hit rate.".format(len(static_features.entries), 100 * static_features.hit_rate()))
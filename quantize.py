@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+import coref_model_sentence_span as cm
+import util
+import window_evaluate
+
+# Layers dominating the inference cost after the LSTM, whose weights are quantized.
+QUANTIZED_SCOPES = ["mention_scores/", "slow_antecedent_scores/", "src_projection/"]
+
+def calibrate(config, num_examples):
+  """
+  Restores the float checkpoint, records the range of the inputs of every quantized linear layer on the first
+  num_examples training documents, and quantizes the weights to 8 bits.
+  :return: {weights key: (quint8 weights, weights min, weights max, inputs min, inputs max)}
+  """
+  tf.reset_default_graph()
+  # Blocked scoring runs in while loops, whose intermediate tensors cannot be fetched. The variables and weight names
+  # are the same with or without blocks.
+  config["slow_antecedent_block_size"] = 0
+  config["coarse_to_fine_block_size"] = 0
+  config["max_antecedent_window"] = 0
+  config["quantized_weights_path"] = ""
+  config["inference_dtype"] = "float32"
+  model = cm.CorefModel(config, record_linear_inputs=True)
+
+  linear = model.scoring_linear
+  layer_inputs = { k: v for k, v in linear.inputs.items() if any(scope in k for scope in QUANTIZED_SCOPES) }
+  layer_weights = { k: linear.weights[k] for k in layer_inputs }
+  names = sorted(layer_inputs)
+
+  with tf.Session() as session:
+    model.restore(session)
+    inputs_min = { n: np.inf for n in names }
+    inputs_max = { n: -np.inf for n in names }
+    with open(config["train_path"]) as f:
+      examples = [json.loads(line) for _, line in zip(range(num_examples), f)]
+    for example in examples:
+      tensorized_example = model.tensorize_example(example, is_training=False)
+      feed_dict = {i:t for i,t in zip(model.input_tensors, tensorized_example)}
+      values = session.run({ n: layer_inputs[n] for n in names }, feed_dict=feed_dict)
+      for n in names:
+        inputs_min[n] = min([inputs_min[n]] + [v.min() for v in values[n] if v.size > 0])
+        inputs_max[n] = max([inputs_max[n]] + [v.max() for v in values[n] if v.size > 0])
+
+    quantized_weights = {}
+    for n in names:
+      weights = session.run(layer_weights[n])
+      quantized, weights_min, weights_max = session.run(tf.quantize(weights, weights.min(), weights.max(), tf.quint8, mode="MIN_FIRST"))
+      quantized_weights[n] = (quantized, weights_min, weights_max, inputs_min[n], inputs_max[n])
+      print("{}: weights in [{:.3f}, {:.3f}], inputs in [{:.3f}, {:.3f}]".format(n, weights_min, weights_max, inputs_min[n], inputs_max[n]))
+  return quantized_weights
+
+def timed_evaluation(config, overrides):
+  start_time = time.time()
+  f1 = window_evaluate.evaluate_with_overrides(config, overrides)
+  return f1, time.time() - start_time
+
+if __name__ == "__main__":
+  # Usage: python quantize.py <experiment> <output.npz> [<num calibration documents>]
+  # Writes the quantized weights, then reports F1 and evaluation time of the float and the quantized scoring layers.
+  # Use them with quantized_weights_path = <output.npz>.
+  config = util.initialize_from_env()
+  output_path = sys.argv[2]
+  num_examples = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+  overrides = { k: config[k] for k in ["slow_antecedent_block_size", "coarse_to_fine_block_size", "max_antecedent_window"] }
+  util.save_quantized_weights(output_path, calibrate(config, num_examples))
+  print("Wrote quantized weights to {}".format(output_path))
+
+  overrides["quantized_weights_path"] = ""
+  float_f1, float_seconds = timed_evaluation(config, overrides)
+  overrides["quantized_weights_path"] = output_path
+  quantized_f1, quantized_seconds = timed_evaluation(config, overrides)
+  print("{:>10} {:>10} {:>10}".format("weights", "F1", "seconds"))
+  print("{:>10} {:>10.2f} {:>10.1f}".format("float", float_f1 * 100, float_seconds))
+  print("{:>10} {:>10.2f} {:>10.1f}".format("int8", quantized_f1 * 100, quantized_seconds))
+  print("F1 delta: {:+.2f}, speedup: {:.2f}x".format((quantized_f1 - float_f1) * 100, float_seconds / quantized_seconds))
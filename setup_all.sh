@@ -5,7 +5,7 @@
 #unzip glove.840B.300d.zip
 #rm glove.840B.300d.zip
 
-# Build custom kernels.
+# Build custom kernels. Without them, coref_ops.py falls back to the slower NumPy span extraction (span_extraction.py).
 TF_CFLAGS=( $(python -c 'import tensorflow as tf; print(" ".join(tf.sysconfig.get_compile_flags()))') )
 TF_LFLAGS=( $(python -c 'import tensorflow as tf; print(" ".join(tf.sysconfig.get_link_flags()))') )
 
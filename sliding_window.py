@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from multiprocessing.pool import ThreadPool
+
+
+def split_example(example, window_size, overlap):
+  """
+  Splits a document into windows of window_size sentences, consecutive windows sharing overlap sentences.
+  :return: list of (word_offset, window_example), where window_example is a regular example restricted to the window
+  with an extra "sentence_offset" field.
+  """
+  sentences = example["sentences"]
+  stride = max(window_size - overlap, 1)
+  windows = []
+  sentence_offset = 0
+  word_offset = 0
+  while True:
+    sentence_end = min(sentence_offset + window_size, len(sentences))
+    windows.append((word_offset, {
+      "doc_key": example["doc_key"],
+      "clusters": [],
+      "sentences": sentences[sentence_offset:sentence_end],
+      "speakers": example["speakers"][sentence_offset:sentence_end],
+      "sentence_offset": sentence_offset,
+    }))
+    if sentence_end == len(sentences):
+      return windows
+    word_offset += sum(len(s) for s in sentences[sentence_offset:sentence_offset + stride])
+    sentence_offset += stride
+
+
+def merge_clusters(window_clusters):
+  """
+  Merges clusters predicted on overlapping windows. Clusters sharing at least one mention are joined.
+  :param window_clusters: list of clusters per window, with mentions as (start, end) in document word offsets.
+  :return: merged clusters as tuples of mentions, ordered by their first mention.
+  """
+  parents = {}
+
+  def _find(m):
+    while parents[m] != m:
+      parents[m] = parents[parents[m]]
+      m = parents[m]
+    return m
+
+  for clusters in window_clusters:
+    for cluster in clusters:
+      root = None
+      for mention in cluster:
+        mention = tuple(mention)
+        parents.setdefault(mention, mention)
+        if root is None:
+          root = _find(mention)
+        else:
+          parents[_find(mention)] = root
+
+  merged = {}
+  for mention in sorted(parents):
+    merged.setdefault(_find(mention), []).append(mention)
+  return sorted((tuple(c) for c in merged.values()), key=lambda c: c[0])
+
+
+def predict_clusters(model, session, example, window_size, overlap, num_threads=1):
+  # Runs the model on each window independently (optionally from several threads sharing the session) and merges the
+  # per-window clusters, so memory is bounded by the window size rather than the document length.
+  def _predict_window(window):
+    word_offset, window_example = window
+    tensorized_example = model.tensorize_example(window_example, is_training=False)
+    feed_dict = {i:t for i,t in zip(model.input_tensors, tensorized_example)}
+    top_span_starts, top_span_ends, predicted_antecedents = session.run(model.top_span_predictions, feed_dict=feed_dict)
+    clusters, _ = model.get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
+    return [[(start + word_offset, end + word_offset) for start, end in cluster] for cluster in clusters]
+
+  windows = split_example(example, window_size, overlap)
+  if num_threads > 1:
+    pool = ThreadPool(num_threads)
+    window_clusters = pool.map(_predict_window, windows)
+    pool.close()
+  else:
+    window_clusters = [_predict_window(w) for w in windows]
+  return merge_clusters(window_clusters)
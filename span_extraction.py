@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def extract_spans_row(span_scores, candidate_starts, candidate_ends, num_output_spans, max_sentence_length, sort_spans):
+  """
+  NumPy version of the span selection of the ExtractSpans op (see extract_spans.h) for one row: greedily selects up to
+  num_output_spans spans by decreasing score (ties broken by lower index), skipping spans that cross a selected span.
+  :return: selected span indices, sorted by (start, end, index) if sort_spans and in selection order otherwise.
+  """
+  num_positions = max(max_sentence_length, candidate_ends.max() + 1 if len(candidate_ends) > 0 else 0)
+  start_to_latest_end = np.full(num_positions + 1, -1, dtype=np.int64)
+  end_to_earliest_start = np.full(num_positions + 1, np.iinfo(np.int64).max, dtype=np.int64)
+
+  selected_spans = []
+  for i in np.lexsort((np.arange(len(span_scores)), -span_scores)):
+    if len(selected_spans) >= num_output_spans:
+      break
+    start, end = candidate_starts[i], candidate_ends[i]
+    # Given (), exists [] such that ( [ ) ] or [ ( ] ).
+    if start_to_latest_end[start + 1:end + 1].max(initial=-1) > end or end_to_earliest_start[start:end].min(initial=start) < start:
+      continue
+    selected_spans.append(i)
+    start_to_latest_end[start] = max(start_to_latest_end[start], end)
+    end_to_earliest_start[end] = min(end_to_earliest_start[end], start)
+
+  selected_spans = np.array(selected_spans, dtype=np.int64)
+  if sort_spans and len(selected_spans) > 0:
+    selected_spans = selected_spans[np.lexsort((selected_spans, candidate_ends[selected_spans], candidate_starts[selected_spans]))]
+  return selected_spans
+
+
+def extract_spans(span_scores, candidate_starts, candidate_ends, num_output_spans, max_sentence_length, sort_spans):
+  """
+  Same inputs and output as the ExtractSpans op: [num_rows, num_input_spans] scores, starts and ends, [num_rows] numbers
+  of spans to select, and [num_rows, max(num_output_spans)] selected indices padded with the first index of their row.
+  """
+  max_num_output_spans = int(np.max(num_output_spans)) if len(num_output_spans) > 0 else 0
+  output_span_indices = np.zeros([len(span_scores), max_num_output_spans], dtype=np.int32)
+  for row in range(len(span_scores)):
+    selected_spans = extract_spans_row(span_scores[row], candidate_starts[row], candidate_ends[row],
+                                       num_output_spans[row], int(max_sentence_length), sort_spans)
+    if len(selected_spans) > 0:
+      output_span_indices[row, :] = selected_spans[0]
+      output_span_indices[row, :len(selected_spans)] = selected_spans
+  return output_span_indices
@@ -0,0 +1,8 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture(params=range(20))
+def random_state(request):
+  # One test per seed, for the tests that run on random inputs (see random_inputs.py).
+  return np.random.RandomState(request.param)
@@ -0,0 +1,37 @@
+import os
+import re
+
+import pytest
+
+import conll_scorer
+
+TEST_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(conll_scorer.__file__)), "conll-2012_score", "scorer", "v8.01", "test")
+TEST_CASE_REGEX = re.compile(r'\{ id => "(\w+)",\s*key_file => "([^"]+)",\s*response_file => "([^"]+)",\s*expected_metrics => \{(.*?)\}\s*\}', re.DOTALL)
+EXPECTED_METRIC_REGEX = re.compile(r'^\s*"(\w+)" => \[([^\]]+)\]', re.MULTILINE)
+
+
+def official_test_cases():
+  # Test cases of the official scorer, with the expected (recall, precision, F1) of the metrics we reproduce.
+  with open(os.path.join(TEST_DIRECTORY, "CorefMetricTestConfig.pm")) as f:
+    config = f.read()
+  for test_id, key_file, response_file, expected_metrics in TEST_CASE_REGEX.findall(config):
+    for metric, values in EXPECTED_METRIC_REGEX.findall(expected_metrics):
+      if metric in conll_scorer.METRICS:
+        # The expected values are Perl arithmetic, which reads the same in Python.
+        yield test_id, key_file, response_file, metric, [eval(v) for v in values.split(",")]
+
+
+TEST_CASES = list(official_test_cases())
+
+
+def test_found_official_test_cases():
+  assert len(TEST_CASES) > 50
+
+
+@pytest.mark.parametrize("test_id, key_file, response_file, metric, expected", TEST_CASES,
+                         ids=["{}-{}".format(t[0], t[3]) for t in TEST_CASES])
+def test_matches_official_scorer(test_id, key_file, response_file, metric, expected):
+  results = conll_scorer.score(os.path.join(TEST_DIRECTORY, key_file), os.path.join(TEST_DIRECTORY, response_file))[metric]
+  # The official test script accepts a total difference of 1e-4 over recall, precision and F1.
+  assert sum(abs(e - a / 100) for e, a in zip(expected, (results["r"], results["p"], results["f"]))) < 1e-4
+
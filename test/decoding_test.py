@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import decoding
+from random_inputs import random_predictions
+
+
+def legacy_get_predicted_antecedents(antecedents, antecedent_scores):
+  predicted_antecedents = []
+  for i, index in enumerate(np.argmax(antecedent_scores, axis=1) - 1):
+    if index < 0:
+      predicted_antecedents.append(-1)
+    else:
+      predicted_antecedents.append(antecedents[i, index])
+  return predicted_antecedents
+
+
+def legacy_get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents):
+  mention_to_predicted = {}
+  predicted_clusters = []
+  for i, predicted_index in enumerate(predicted_antecedents):
+    if predicted_index < 0:
+      continue
+    predicted_antecedent = (int(top_span_starts[predicted_index]), int(top_span_ends[predicted_index]))
+    if predicted_antecedent in mention_to_predicted:
+      predicted_cluster = mention_to_predicted[predicted_antecedent]
+    else:
+      predicted_cluster = len(predicted_clusters)
+      predicted_clusters.append([predicted_antecedent])
+      mention_to_predicted[predicted_antecedent] = predicted_cluster
+    mention = (int(top_span_starts[i]), int(top_span_ends[i]))
+    predicted_clusters[predicted_cluster].append(mention)
+    mention_to_predicted[mention] = predicted_cluster
+  predicted_clusters = [tuple(pc) for pc in predicted_clusters]
+  mention_to_predicted = { m:predicted_clusters[i] for m,i in mention_to_predicted.items() }
+  return predicted_clusters, mention_to_predicted
+
+
+def test_matches_legacy(random_state):
+  k = random_state.randint(1, 200)
+  top_span_starts, top_span_ends, antecedents, antecedent_scores = random_predictions(random_state, k, random_state.randint(1, 20))
+
+  predicted_antecedents = decoding.get_predicted_antecedents(antecedents, antecedent_scores)
+  assert list(predicted_antecedents) == legacy_get_predicted_antecedents(antecedents, antecedent_scores)
+  assert decoding.get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents) == \
+    legacy_get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
+
+
+def test_cluster_order():
+  # Span 3 starts the cluster of span 2 before span 4 joins the cluster of span 0.
+  starts = np.array([0, 2, 4, 6, 8])
+  ends = starts + 1
+  clusters, mention_to_predicted = decoding.get_predicted_clusters(starts, ends, [-1, -1, -1, 2, 0])
+  assert clusters == [((4, 5), (6, 7)), ((0, 1), (8, 9))]
+  assert mention_to_predicted[(8, 9)] == clusters[1]
+
+
+def test_no_clusters():
+  assert decoding.get_predicted_clusters(np.array([0]), np.array([0]), [-1]) == ([], {})
+
+
+def test_probabilities_match_argmax():
+  random_state = np.random.RandomState(0)
+  top_span_starts, top_span_ends, antecedents, antecedent_scores = random_predictions(random_state, 100, 10)
+  best_antecedents, best_probabilities = decoding.get_antecedent_probabilities(antecedents, antecedent_scores)
+  assert best_antecedents[0] == -1 and best_probabilities[0] == 0
+  # The best antecedent wins the argmax exactly when it is more likely than the dummy antecedent.
+  probabilities = np.exp(antecedent_scores) / np.exp(antecedent_scores).sum(1, keepdims=True)
+  linked = best_probabilities > probabilities[:, 0]
+  assert (np.where(linked, best_antecedents, -1) == decoding.get_predicted_antecedents(antecedents, antecedent_scores)).all()
+
+
+@pytest.mark.parametrize("threshold", [0.0, 0.1, 0.3, 0.6])
+def test_clusters_at_threshold(threshold):
+  random_state = np.random.RandomState(1)
+  top_span_starts, top_span_ends, antecedents, antecedent_scores = random_predictions(random_state, 200, 20)
+  best_antecedents, best_probabilities = decoding.get_antecedent_probabilities(antecedents, antecedent_scores)
+  predicted_antecedents = decoding.get_thresholded_antecedents(best_antecedents, best_probabilities, threshold)
+  clusters, _ = decoding.get_predicted_clusters(top_span_starts, top_span_ends, predicted_antecedents)
+
+  mention_antecedents = decoding.get_mention_antecedents(top_span_starts, top_span_ends, best_antecedents, best_probabilities)
+  assert decoding.clusters_at_threshold(mention_antecedents, threshold) == clusters
+
+  # Clusters whose confidence is above a higher threshold are still decoded whole at that threshold.
+  confidences = decoding.get_cluster_confidences(predicted_antecedents, best_probabilities)
+  assert len(confidences) == len(clusters)
+  higher_clusters = set(decoding.clusters_at_threshold(mention_antecedents, threshold + 0.1))
+  for cluster, confidence in zip(clusters, confidences):
+    assert confidence >= threshold
+    if confidence >= threshold + 0.1:
+      assert cluster in higher_clusters
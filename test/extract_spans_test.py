@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+import span_extraction
+from random_inputs import random_candidates
+
+
+def crosses(s1, e1, s2, e2):
+  return s1 < s2 <= e1 < e2 or s2 < s1 <= e2 < e1
+
+
+def reference_extract_spans(scores, starts, ends, num_output_spans, sort_spans):
+  # Checks each candidate against every selected span, in the order of the original kernel.
+  selected = []
+  for i in sorted(range(len(scores)), key=lambda i: (-scores[i], i)):
+    if len(selected) == num_output_spans:
+      break
+    if not any(crosses(starts[i], ends[i], starts[j], ends[j]) for j in selected):
+      selected.append(i)
+  if sort_spans:
+    selected.sort(key=lambda i: (starts[i], ends[i], i))
+  return selected
+
+
+@pytest.mark.parametrize("sort_spans", [True, False])
+def test_matches_reference(random_state, sort_spans):
+  num_words = random_state.randint(1, 60)
+  starts, ends = random_candidates(random_state, num_words, random_state.randint(1, 10))
+  # Rounded scores, so that ties are exercised too.
+  scores = np.round(random_state.randn(len(starts)), 1).astype(np.float32)
+  k = random_state.randint(1, num_words + 1)
+
+  expected = reference_extract_spans(scores, starts, ends, k, sort_spans)
+  output = span_extraction.extract_spans(scores[None], starts[None], ends[None], np.array([k], dtype=np.int32), num_words, sort_spans)
+  assert output.dtype == np.int32
+  assert output.shape == (1, k)
+  assert list(output[0, :len(expected)]) == expected
+  assert all(output[0, len(expected):] == expected[0])
+
+
+def test_rows_are_padded_to_the_largest_output():
+  scores = np.array([[3, 2, 1], [1, 2, 3]], dtype=np.float32)
+  starts = np.array([[0, 1, 2], [0, 1, 2]], dtype=np.int32)
+  ends = np.array([[0, 1, 2], [0, 1, 2]], dtype=np.int32)
+  output = span_extraction.extract_spans(scores, starts, ends, np.array([1, 3], dtype=np.int32), 3, True)
+  assert output.tolist() == [[0, 0, 0], [0, 1, 2]]
+
+
+def test_crossing_spans_are_skipped():
+  # [0, 2] is selected first, so [1, 3] crosses it while [1, 2] is nested in it.
+  scores = np.array([[3, 2, 1]], dtype=np.float32)
+  starts = np.array([[0, 1, 1]], dtype=np.int32)
+  ends = np.array([[2, 3, 2]], dtype=np.int32)
+  output = span_extraction.extract_spans(scores, starts, ends, np.array([2], dtype=np.int32), 4, False)
+  assert output.tolist() == [[0, 2]]
+
+
+def test_matches_kernel():
+  tf = pytest.importorskip("tensorflow")
+  library_path = os.path.join(os.path.dirname(os.path.abspath(span_extraction.__file__)), "coref_kernels.so")
+  if not os.path.exists(library_path):
+    pytest.skip("coref_kernels.so is not built")
+  extract_spans = tf.load_op_library(library_path).extract_spans
+
+  random_state = np.random.RandomState(0)
+  starts, ends = random_candidates(random_state, 200, 30)
+  scores = random_state.randn(3, len(starts)).astype(np.float32)
+  starts, ends = np.tile(starts, [3, 1]), np.tile(ends, [3, 1])
+  k = np.array([80, 40, 10], dtype=np.int32)
+  with tf.Session() as session:
+    kernel_output = session.run(extract_spans(scores, starts, ends, k, 200, True))
+  assert (kernel_output == span_extraction.extract_spans(scores, starts, ends, k, 200, True)).all()
+
+
+@pytest.mark.parametrize("sort_spans", [True, False])
+def test_tf_matches_numpy(sort_spans):
+  tf = pytest.importorskip("tensorflow")
+  import coref_ops
+
+  random_state = np.random.RandomState(1)
+  starts, ends = random_candidates(random_state, 100, 10)
+  scores = np.round(random_state.randn(3, len(starts)), 1).astype(np.float32)
+  starts, ends = np.tile(starts, [3, 1]), np.tile(ends, [3, 1])
+  k = np.array([40, 20, 0], dtype=np.int32)
+  # A pool of every candidate, so that the selection is exact.
+  with tf.Session() as session:
+    output = session.run(coref_ops.extract_spans_tf(scores, starts, ends, k, 100, sort_spans, pool_ratio=len(starts[0])))
+  assert (output == span_extraction.extract_spans(scores, starts, ends, k, 100, sort_spans)).all()
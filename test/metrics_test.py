@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+
+import deep_coref_evaluator
+import metrics
+from random_inputs import random_document
+
+
+def test_ceafe_empty_document():
+  assert metrics.ceafe([], [((0, 1), (3, 4))]) == (0, 0, 0, 1)
+
+
+def dense_ceafe(clusters, gold_clusters):
+  # Aligns all pairs of clusters at once, as ceafe did before splitting the overlap graph.
+  clusters = [c for c in clusters if len(c) != 1]
+  scores = np.array([[metrics.phi4(gc, c) for c in clusters] for gc in gold_clusters]).reshape([len(gold_clusters), len(clusters)])
+  rows, columns = linear_sum_assignment(-scores)
+  similarity = sum(scores[rows, columns])
+  return similarity, len(clusters), similarity, len(gold_clusters)
+
+
+def test_ceafe_matches_dense_alignment(random_state):
+  predicted, gold = random_document(random_state, random_state.randint(1, 300))
+  expected = dense_ceafe(predicted, gold)
+  assert metrics.ceafe(predicted, gold) == pytest.approx(expected)
+  assert deep_coref_evaluator.ceafe(predicted, gold) == pytest.approx(expected)
+
+
+def test_aligned_similarity_components():
+  # Gold 0 and 1 compete for predicted 0; gold 2 only overlaps predicted 2; gold 3 and predicted 1 overlap nothing.
+  gold = np.array([0, 0, 1, 2])
+  predicted = np.array([0, 2, 0, 2])
+  similarities = np.array([0.6, 0.1, 0.5, 0.9])
+  # All three pairs form one component, whose best alignment is 0-0 and 2-2.
+  assert metrics.aligned_similarity(gold, predicted, similarities, 4, 3) == pytest.approx(1.5)
@@ -0,0 +1,36 @@
+import numpy as np
+
+# Random inputs shared by the tests.
+
+
+def random_candidates(random_state, num_words, max_span_width):
+  # Every span of up to max_span_width words, in random order.
+  starts, ends = [], []
+  for start in range(num_words):
+    for end in range(start, min(start + max_span_width, num_words)):
+      starts.append(start)
+      ends.append(end)
+  order = random_state.permutation(len(starts))
+  return np.array(starts, dtype=np.int32)[order], np.array(ends, dtype=np.int32)[order]
+
+
+def random_predictions(random_state, k, c):
+  top_span_starts = np.sort(random_state.choice(3 * k, k, replace=False))
+  top_span_ends = top_span_starts + np.arange(k) % 5
+  # Antecedents are earlier top spans; the scores of the first spans are masked as in the model.
+  antecedent_offsets = np.arange(1, c + 1)[None, :]
+  antecedents = np.maximum(np.arange(k)[:, None] - antecedent_offsets, 0)
+  antecedent_scores = random_state.randn(k, c + 1)
+  antecedent_scores[:, 1:][np.arange(k)[:, None] - antecedent_offsets < 0] = -np.inf
+  return top_span_starts, top_span_ends, antecedents, antecedent_scores
+
+
+def random_document(random_state, num_words):
+  # Gold and predicted clusters over distinct spans, with singletons and mentions missing from either side.
+  spans = [(s, s + random_state.randint(0, 4)) for s in random_state.choice(num_words, num_words // 2, replace=False)]
+  def _clusters(mentions):
+    assignments = random_state.randint(0, max(1, len(mentions) // 3), size=len(mentions))
+    return [tuple(m for m, a in zip(mentions, assignments) if a == cluster) for cluster in np.unique(assignments)]
+  gold = _clusters([m for m in spans if random_state.rand() < 0.8])
+  predicted = _clusters([m for m in spans if random_state.rand() < 0.8])
+  return predicted, gold
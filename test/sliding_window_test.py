@@ -0,0 +1,41 @@
+import sliding_window
+
+
+def make_example(sentence_lengths):
+  sentences = [["w"] * l for l in sentence_lengths]
+  return {
+    "doc_key": "nw",
+    "clusters": [],
+    "sentences": sentences,
+    "speakers": [[""] * l for l in sentence_lengths],
+  }
+
+
+def test_split_example_covers_document():
+  example = make_example([3, 1, 4, 1, 5, 9, 2])
+  windows = sliding_window.split_example(example, 3, 1)
+  assert [w["sentence_offset"] for _, w in windows] == [0, 2, 4]
+  assert [offset for offset, _ in windows] == [0, 4, 9]
+  assert windows[-1][1]["sentences"] == example["sentences"][4:]
+
+
+def test_split_example_single_window():
+  example = make_example([2, 2])
+  windows = sliding_window.split_example(example, 5, 2)
+  assert len(windows) == 1
+  assert windows[0][1]["sentences"] == example["sentences"]
+
+
+def test_merge_clusters_through_shared_mentions():
+  window_clusters = [
+    [((0, 1), (5, 5)), ((2, 2), (3, 3))],
+    [((5, 5), (9, 10)), ((12, 12), (14, 14))],
+  ]
+  merged = sliding_window.merge_clusters(window_clusters)
+  assert merged == [((0, 1), (5, 5), (9, 10)), ((2, 2), (3, 3)), ((12, 12), (14, 14))]
+
+
+if __name__ == "__main__":
+  test_split_example_covers_document()
+  test_split_example_single_window()
+  test_merge_clusters_through_shared_mentions()
@@ -14,6 +14,8 @@ import sys
 import numpy as np
 import tensorflow as tf
 import pyhocon
+from tensorflow.contrib.rnn.python.ops import lstm_ops
+from tensorflow.python.ops import gen_math_ops
 
 
 def initialize_from_env():
@@ -72,8 +74,8 @@ def maybe_divide(x, y):
   return 0 if y == 0 else x / float(y)
 
 
-def projection(inputs, output_size, initializer=None):
-  return ffnn(inputs, 0, -1, output_size, dropout=None, output_weights_initializer=initializer)
+def projection(inputs, output_size, initializer=None, linear=None):
+  return ffnn(inputs, 0, -1, output_size, dropout=None, output_weights_initializer=initializer, linear=linear)
 
 
 def highway(inputs, num_layers, dropout):
@@ -92,7 +94,8 @@ def shape(x, dim):
   return x.get_shape()[dim].value or tf.shape(x)[dim]
 
 
-def ffnn(inputs, num_hidden_layers, hidden_size, output_size, dropout, output_weights_initializer=None):
+def ffnn(inputs, num_hidden_layers, hidden_size, output_size, dropout, output_weights_initializer=None, linear=None):
+  linear = linear or Linear()
   if len(inputs.get_shape()) > 3:
     raise ValueError("FFNN with rank {} not supported".format(len(inputs.get_shape())))
 
@@ -104,10 +107,39 @@ def ffnn(inputs, num_hidden_layers, hidden_size, output_size, dropout, output_we
   else:
     current_inputs = inputs
 
+  input_weights, input_bias = ffnn_input_weights([shape(current_inputs, 1)], num_hidden_layers, hidden_size, output_size, output_weights_initializer)
+  outputs = ffnn_from_input_layer(linear(current_inputs, *input_weights[0]) + input_bias, num_hidden_layers, hidden_size, output_size, dropout, output_weights_initializer, linear)
+
+  if len(inputs.get_shape()) == 3:
+    outputs = tf.reshape(outputs, [batch_size, seqlen, output_size])
+  return outputs
+
+def ffnn_input_weights(input_sizes, num_hidden_layers, hidden_size, output_size, output_weights_initializer=None):
+  # Creates the first layer of ffnn() for inputs that are a concatenation of parts with the given sizes. The weights are
+  # returned split into one (weights, key) block per part, so that the linear term of each part can be computed
+  # separately. The key of a block is the name of the variable followed by the index of the block (see Linear).
+  if num_hidden_layers > 0:
+    weights = tf.get_variable("hidden_weights_0", [sum(input_sizes), hidden_size])
+    bias = tf.get_variable("hidden_bias_0", [hidden_size])
+  else:
+    weights = tf.get_variable("output_weights", [sum(input_sizes), output_size], initializer=output_weights_initializer)
+    bias = tf.get_variable("output_bias", [output_size])
+  keys = ["{}#{}".format(weights.name, i) for i in range(len(input_sizes))]
+  return list(zip(tf.split(weights, input_sizes, 0), keys)), bias
+
+def ffnn_from_input_layer(input_layer_outputs, num_hidden_layers, hidden_size, output_size, dropout, output_weights_initializer=None, linear=None):
+  # Completes ffnn() given the pre-activation outputs of its first layer (see ffnn_input_weights).
+  linear = linear or Linear()
+  if num_hidden_layers == 0:
+    return input_layer_outputs
+
+  current_inputs = input_layer_outputs
   for i in range(num_hidden_layers):
-    hidden_weights = tf.get_variable("hidden_weights_{}".format(i), [shape(current_inputs, 1), hidden_size])
-    hidden_bias = tf.get_variable("hidden_bias_{}".format(i), [hidden_size])
-    current_outputs = tf.nn.relu(tf.nn.xw_plus_b(current_inputs, hidden_weights, hidden_bias))
+    if i > 0:
+      hidden_weights = tf.get_variable("hidden_weights_{}".format(i), [shape(current_inputs, 1), hidden_size])
+      hidden_bias = tf.get_variable("hidden_bias_{}".format(i), [hidden_size])
+      current_inputs = linear(current_inputs, hidden_weights) + hidden_bias
+    current_outputs = tf.nn.relu(current_inputs)
 
     if dropout is not None:
       current_outputs = tf.nn.dropout(current_outputs, dropout)
@@ -115,11 +147,55 @@ def ffnn(inputs, num_hidden_layers, hidden_size, output_size, dropout, output_we
 
   output_weights = tf.get_variable("output_weights", [shape(current_inputs, 1), output_size], initializer=output_weights_initializer)
   output_bias = tf.get_variable("output_bias", [output_size])
-  outputs = tf.nn.xw_plus_b(current_inputs, output_weights, output_bias)
-
-  if len(inputs.get_shape()) == 3:
-    outputs = tf.reshape(outputs, [batch_size, seqlen, output_size])
-  return outputs
+  return linear(current_inputs, output_weights) + output_bias
+
+class Linear(object):
+  """
+  Computes inputs [n, input_size] x weights [input_size, output_size] for the ffnn() layers. Weights whose key is in
+  quantized_weights (as returned by load_quantized_weights) are replaced by their 8-bit version. With record_inputs,
+  the inputs and weights of every call are kept by key to calibrate the quantization (see quantize.py).
+  """
+  def __init__(self, quantized_weights=None, record_inputs=False):
+    self.quantized_weights = quantized_weights or {}
+    self.inputs = {} if record_inputs else None
+    self.weights = {} if record_inputs else None
+
+  def __call__(self, inputs, weights, key=None):
+    # The key defaults to the name of the weights, which must then be a variable rather than a slice of one.
+    key = key or weights.name
+    if self.inputs is not None:
+      self.inputs.setdefault(key, []).append(inputs)
+      self.weights[key] = weights
+    if key in self.quantized_weights:
+      return quantized_linear(inputs, *self.quantized_weights[key])
+    return tf.matmul(inputs, weights)
+
+def quantized_linear(inputs, weights, weights_min, weights_max, inputs_min, inputs_max):
+  # Quantizes the inputs to 8 bits with their calibrated range and multiplies them with the 8-bit weights, accumulating
+  # in 32 bits.
+  inputs = tf.clip_by_value(inputs, inputs_min, inputs_max)
+  quantized_inputs, quantized_inputs_min, quantized_inputs_max = tf.quantize(inputs, inputs_min, inputs_max, tf.quint8, mode="MIN_FIRST")
+  outputs, outputs_min, outputs_max = gen_math_ops.quantized_mat_mul(quantized_inputs, tf.constant(weights),
+                                                                     quantized_inputs_min, quantized_inputs_max,
+                                                                     weights_min, weights_max, Toutput=tf.qint32)
+  return tf.dequantize(outputs, outputs_min, outputs_max)
+
+def save_quantized_weights(path, quantized_weights):
+  # quantized_weights: {weights key: (quint8 weights, weights min, weights max, inputs min, inputs max)}
+  names = sorted(quantized_weights)
+  arrays = { "weights_{}".format(i): quantized_weights[n][0] for i, n in enumerate(names) }
+  np.savez(path, names=np.array(names), ranges=np.array([quantized_weights[n][1:] for n in names], dtype=np.float32), **arrays)
+
+def load_quantized_weights(path):
+  with np.load(path) as f:
+    return { str(n): (f["weights_{}".format(i)],) + tuple(float(r) for r in f["ranges"][i]) for i, n in enumerate(f["names"]) }
+
+def cast_variables_getter(dtype):
+  # Custom getter for tf.variable_scope that reads variables in another dtype. The variables themselves (and therefore
+  # the checkpoints) stay float32.
+  def _getter(getter, *args, **kwargs):
+    return tf.cast(getter(*args, **kwargs), dtype)
+  return _getter
 
 def cnn(inputs, filter_sizes, num_filters):
   num_words = shape(inputs, 0)
@@ -150,6 +226,28 @@ def batch_gather(emb, indices):
     gathered = tf.squeeze(gathered, 2) # [batch_size, num_indices]
   return gathered
 
+def blocked_map(fn, inputs, block_size, dtypes):
+  # Applies fn to consecutive blocks of block_size rows of inputs, one block at a time, and concatenates the
+  # outputs along the first dimension. Peak memory is bounded by the intermediate tensors of a single block.
+  num_rows = shape(inputs[0], 0)
+  num_blocks = (num_rows + block_size - 1) // block_size
+
+  def _map_block(i, outputs):
+    block_start = i * block_size
+    block_outputs = fn(*[x[block_start:block_start + block_size] for x in inputs])
+    return i + 1, [o.write(i, b) for o, b in zip(outputs, block_outputs)]
+
+  def _map_blocks():
+    outputs = [tf.TensorArray(dtype, size=num_blocks, infer_shape=False) for dtype in dtypes]
+    _, outputs = tf.while_loop(lambda i, _: i < num_blocks, _map_block, [0, outputs], parallel_iterations=1)
+    return [o.concat() for o in outputs]
+
+  # A TensorArray of size zero cannot be concatenated without a static element shape, so empty inputs (e.g. no top
+  # spans in a one or two word document) go through fn directly.
+  if isinstance(num_rows, int):
+    return _map_blocks() if num_rows > 0 else list(fn(*inputs))
+  return tf.cond(num_rows > 0, _map_blocks, lambda: list(fn(*inputs)), strict=True)
+
 class RetrievalEvaluator(object):
   def __init__(self):
     self._num_correct = 0
@@ -254,6 +352,36 @@ class CustomLSTMCell(tf.contrib.rnn.RNNCell):
       new_state = tf.contrib.rnn.LSTMStateTuple(new_c, new_h)
       return new_h, new_state
 
+  def fused_call(self, inputs, sequence_length, scope=None):
+    """Runs the cell over a whole [batch, time, emb] sequence with the fused LSTMBlock CPU kernel.
+
+    The kernel uses the same variables as __call__. Its [i, j, f, o] gates are filled with the coupled forget gate
+    f = 1 - sigmoid(i) = sigmoid(-i), so outputs match the step-by-step cell. Recurrent dropout is not applied, which
+    makes no difference at inference.
+    """
+    with tf.variable_scope(scope or type(self).__name__):  # "CustomLSTMCell"
+      weights = tf.get_variable("output_weights", [shape(inputs, 2) + self.output_size, 3 * self.output_size], initializer=self._initializer)
+      bias = tf.get_variable("output_bias", [3 * self.output_size])
+    i_weights, j_weights, o_weights = tf.split(weights, 3, 1)
+    i_bias, j_bias, o_bias = tf.split(bias, 3, 0)
+    batch_size = shape(inputs, 0)
+    no_peephole = tf.zeros([self.output_size])
+    _, _, _, _, _, _, outputs = lstm_ops.gen_lstm_ops.block_lstm(
+      seq_len_max=tf.to_int64(tf.reduce_max(sequence_length)),
+      x=tf.transpose(inputs, [1, 0, 2]),
+      cs_prev=tf.tile(self._initial_state.c, [batch_size, 1]),
+      h_prev=tf.tile(self._initial_state.h, [batch_size, 1]),
+      w=tf.concat([i_weights, j_weights, -i_weights, o_weights], 1),
+      wci=no_peephole,
+      wcf=no_peephole,
+      wco=no_peephole,
+      b=tf.concat([i_bias, j_bias, -i_bias, o_bias], 0),
+      forget_bias=0.0,
+      cell_clip=-1.0,
+      use_peephole=False) # [time, batch, emb]
+    outputs = tf.transpose(outputs, [1, 0, 2]) # [batch, time, emb]
+    return outputs * tf.expand_dims(tf.sequence_mask(sequence_length, shape(inputs, 1), dtype=tf.float32), 2)
+
   def _orthonormal_initializer(self, scale=1.0):
     def _initializer(shape, dtype=tf.float32, partition_info=None):
       M1 = np.random.randn(shape[0], shape[0]).astype(np.float32)
@@ -275,3 +403,13 @@ class CustomLSTMCell(tf.contrib.rnn.RNNCell):
       params = np.concatenate([initializer([shape[0], o], dtype, partition_info) for o in output_sizes], 1)
       return params
     return _initializer
+
+def fused_bidirectional_rnn(cell_fw, cell_bw, inputs, sequence_length):
+  # Fused counterpart of tf.nn.bidirectional_dynamic_rnn for CustomLSTMCells, reading the same variables.
+  with tf.variable_scope("bidirectional_rnn"):
+    with tf.variable_scope("fw"):
+      fw_outputs = cell_fw.fused_call(inputs, sequence_length)
+    with tf.variable_scope("bw"):
+      reversed_inputs = tf.reverse_sequence(inputs, sequence_length, seq_axis=1, batch_axis=0)
+      bw_outputs = tf.reverse_sequence(cell_bw.fused_call(reversed_inputs, sequence_length), sequence_length, seq_axis=1, batch_axis=0)
+  return fw_outputs, bw_outputs
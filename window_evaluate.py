@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+
+import tensorflow as tf
+import coref_model_sentence_span as cm
+import util
+
+def evaluate_with_overrides(config, overrides):
+  # Rebuilds the model with the given config values and evaluates the restored checkpoint on the eval set.
+  tf.reset_default_graph()
+  for key, value in overrides.items():
+    config[key] = value
+  model = cm.CorefModel(config)
+  with tf.Session() as session:
+    model.restore(session)
+    _, f1 = model.evaluate(session)
+  return f1
+
+if __name__ == "__main__":
+  # Usage: python window_evaluate.py <experiment> <window> [<window> ...]
+  config = util.initialize_from_env()
+  windows = [int(w) for w in sys.argv[2:]]
+
+  # Window 0 is the unrestricted baseline.
+  results = [(w, evaluate_with_overrides(config, { "max_antecedent_window": w })) for w in [0] + windows]
+  baseline_f1 = results[0][1]
+
+  print("{:>10} {:>10} {:>10}".format("window", "F1", "delta"))
+  for window, f1 in results:
+    print("{:>10} {:>10.2f} {:>+10.2f}".format(window or "all", f1 * 100, (f1 - baseline_f1) * 100))